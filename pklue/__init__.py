@@ -1,3 +1,12 @@
-from .pklue import get_mixture
+from .registry import list_datasets, get_info
 
 __version__ = '1.0.0'
+
+
+def __getattr__(name):
+    # 'get_mixture' imports huggingface datasets, so it is loaded on first access
+    if name == 'get_mixture':
+        from .pklue import get_mixture
+        globals()['get_mixture'] = get_mixture
+        return get_mixture
+    raise AttributeError(f"module 'pklue' has no attribute '{name}'")
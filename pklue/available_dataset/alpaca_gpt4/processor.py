@@ -1,22 +1,20 @@
-from datasets import Dataset
+from ...utils import convert_to_chat, load_dataset_max_examples
 
-from ...utils import load_dataset_max_examples
 
+def _make_prompt(example):
+    if not example['input']:
+        prompt = example['instruction']
+    else:
+        prompt = f"{example['instruction']}\n\n{example['input']}"
+    return {'prompt': prompt}
 
-def process(max_examples, split):
-    ds = load_dataset_max_examples("vicgalle/alpaca-gpt4", split, max_examples)
-    l = []
-    for e in ds:
-        if not e['input']:
-            prompt = e['instruction']
-        else:
-            prompt = f"{e['instruction']}\n\n{e['input']}"
-        l.append({
-            'chat': [
-                ('user', prompt),
-                ('assistant', e['output'])
-            ]
-        })
-    ds = Dataset.from_list(l)
+
+def process(max_examples, split, streaming=False):
+    ds = load_dataset_max_examples("vicgalle/alpaca-gpt4", split, max_examples, streaming=streaming)
+    ds = ds.select_columns(['instruction', 'input', 'output'])
+
+    ds = ds.map(_make_prompt, remove_columns=['instruction', 'input'])
+    ds = ds.rename_column('output', 'completion')
+    ds = convert_to_chat(ds)
 
     return ds
@@ -1,6 +1,7 @@
-from ...utils import load_dataset_max_examples
+from ...utils import convert_pairs_to_chat, load_dataset_max_examples
 
 
-def process(max_examples, split):
-    ds = load_dataset_max_examples("nlpai-lab/alpaca_gpt4_filtered", split, max_examples)
+def process(max_examples, split, streaming=False):
+    ds = load_dataset_max_examples("nlpai-lab/alpaca_gpt4_filtered", split, max_examples, streaming=streaming)
+    ds = convert_pairs_to_chat(ds)
     return ds
@@ -1,14 +1,15 @@
-from datasets import Dataset
+from ...utils import convert_to_chat, load_dataset_max_examples
 
-from ...utils import load_dataset_max_examples
 
-
-def process(max_examples, split):
-    ds = load_dataset_max_examples("nlpai-lab/kullm3-dolly-gpt4", split, max_examples)
+def process(max_examples, split, streaming=False):
+    ds = load_dataset_max_examples("nlpai-lab/kullm3-dolly-gpt4", split, max_examples, streaming=streaming)
 
     # change 'instruction', 'output' column names to 'user', 'assistant' and make it dictionary form
-    ds = Dataset.from_list([{
-        'chat': [('user', e['instruction']), ('assistant', e['output'])]
-    } for e in ds])
-
-    return ds
\ No newline at end of file
+    ds = ds.select_columns(['instruction', 'output'])
+    ds = ds.rename_columns({
+        'instruction': 'prompt',
+        'output': 'completion',
+    })
+    ds = convert_to_chat(ds)
+
+    return ds
@@ -1,27 +1,20 @@
 """
 For VRAM-critical debugging
-Now it targets 8192 context length. (longer sequence is to be updated)
-
-IMPORTANT: This library cannot works in Windows
+Now it targets 8192 context length: 8 turns of 1000 characters. see pklue.synthetic for other lengths.
 """
-from datasets import Dataset
-import kipsum
+import zlib
+
+import numpy as np
+
+from ...rng import draw_seed
+from ...synthetic import synthetic_chats
+
+NUM_ROWS = 1000
+NUM_TURNS = 8
+TURN_CHARS = 1000
 
 
-def process(max_examples, split):
-    l = []
-    kip = kipsum.Kipsum()
-    for i in range(1000):
-        l.append({
-            'chat': [
-                ['user', kip.sentence(1000)],
-                ['assistant', kip.sentence(1000)],
-                ['user', kip.sentence(1000)],
-                ['assistant', kip.sentence(1000)],
-                ['user', kip.sentence(1000)],
-                ['assistant', kip.sentence(1000)],
-                ['user', kip.sentence(1000)],
-                ['assistant', kip.sentence(1000)],
-            ]
-        })
-    return Dataset.from_list(l)
+def process(max_examples, split, streaming=False):
+    # every split gets its own rows
+    rng = np.random.default_rng([draw_seed(), zlib.crc32(split.encode('utf-8'))])
+    return synthetic_chats(max_examples or NUM_ROWS, NUM_TURNS, TURN_CHARS, streaming=streaming, rng=rng)
@@ -1,15 +1,14 @@
 from pathlib import Path
 
-import yaml
+from ...utils import make_lazy_template_chat, make_random_template_data, convert_to_chat, load_dataset_max_examples
+from ...templates import load_templates
 
-from ...utils import make_random_template_data, convert_to_chat, load_dataset_max_examples
 
+def process(max_examples, split, streaming=False, lazy=False):
+    """lazy: keep the passages once and render chats on access. see utils.make_lazy_template_chat."""
+    ds = load_dataset_max_examples('klue', split, max_examples, subset='mrc', streaming=streaming)
 
-def process(max_examples, split):
-    ds = load_dataset_max_examples('klue', split, max_examples, subset='mrc')
-
-    with open(Path(__file__).parent / "template_mrc.yaml", 'rt', encoding='utf-8') as f:
-        templates = yaml.load(f, Loader=yaml.BaseLoader)['klue_mrc']
+    templates = load_templates(Path(__file__).parent / "template_mrc.yaml", 'klue_mrc')
 
     # add an 'answer' column from 'answers' column
     new_ds = ds.map(
@@ -17,6 +16,8 @@ def process(max_examples, split):
         remove_columns=['answers']  # for avoiding mistakes
     )
 
+    if lazy and not streaming:
+        return make_lazy_template_chat(templates, new_ds)
     new_ds = make_random_template_data(templates, new_ds)
     new_ds = convert_to_chat(new_ds)
     return new_ds
@@ -1,28 +1,19 @@
 from pathlib import Path
 
-import yaml
-from datasets import Dataset
+from ...dedup import deduplicate
+from ...utils import _make_options_str, make_random_template_data, convert_to_chat, load_dataset_max_examples, subsample
+from ...templates import load_templates
 
-from ...utils import _make_options_str, make_random_template_data, convert_to_chat, load_dataset_max_examples
 
+def process(max_examples, split, streaming=False):
+    # since we're gonna deduplication, get all data. (klue-nli is small, so it is not streamed)
+    ds = load_dataset_max_examples('klue', split, None, subset='nli')
 
-def process(max_examples, split):
-    ds = load_dataset_max_examples('klue', split, None, subset='nli')  # since we're gonna deduplication, get all data.
-
-    with open(Path(__file__).parent / "template_nli.yaml", 'rt', encoding='utf-8') as f:
-        templates = yaml.load(f, Loader=yaml.BaseLoader)['klue_nli']
+    templates = load_templates(Path(__file__).parent / "template_nli.yaml", 'klue_nli')
 
     # deduplication for nli subset. since klue-nli dataset have too many duplicated premise
-    deduplicated_ds = {c: [] for c in ds.column_names}
-    set_of_premise = set()
-    for row in ds:
-        if row['premise'] in set_of_premise:
-            continue
-        for k, v in row.items():
-            deduplicated_ds[k].append(v)
-    deduplicated_ds = Dataset.from_dict(deduplicated_ds)
-    if max_examples and len(deduplicated_ds) > max_examples:
-        deduplicated_ds = deduplicated_ds.train_test_split(train_size=max_examples)['train']  # apply after dedup
+    deduplicated_ds = deduplicate(ds, columns=['premise'])
+    deduplicated_ds = subsample(deduplicated_ds, max_examples)  # apply after dedup
 
     # add 'options', 'answer' column to dataset
     options_str = ['수반', '중립', '모순']
@@ -32,4 +23,6 @@ def process(max_examples, split):
 
     new_ds = make_random_template_data(templates, new_ds)
     new_ds = convert_to_chat(new_ds)
+    if streaming:
+        new_ds = new_ds.to_iterable_dataset()
     return new_ds
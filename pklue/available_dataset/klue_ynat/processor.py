@@ -1,15 +1,13 @@
 from pathlib import Path
 
-import yaml
-
 from ...utils import _make_options_str, make_random_template_data, convert_to_chat, load_dataset_max_examples
+from ...templates import load_templates
 
 
-def process(max_examples, split):
-    ds = load_dataset_max_examples('klue', split, max_examples, subset='ynat')
+def process(max_examples, split, streaming=False):
+    ds = load_dataset_max_examples('klue', split, max_examples, subset='ynat', streaming=streaming)
 
-    with open(Path(__file__).parent / "template_ynat.yaml", 'rt', encoding='utf-8') as f:
-        templates = yaml.load(f, Loader=yaml.BaseLoader)['klue_ynat']
+    templates = load_templates(Path(__file__).parent / "template_ynat.yaml", 'klue_ynat')
 
     # make options string
     options_str = ['IT과학', '경제', '사회', '생활문화', '세계', '스포츠', '정치']
@@ -1,8 +1,8 @@
 from ...utils import convert_to_chat, load_dataset_max_examples
 
 
-def process(max_examples, split):
-    ds = load_dataset_max_examples("beomi/KoAlpaca-v1.1a", split, max_examples)
+def process(max_examples, split, streaming=False):
+    ds = load_dataset_max_examples("beomi/KoAlpaca-v1.1a", split, max_examples, streaming=streaming)
     ds = ds.select_columns(['instruction', 'output'])
 
     # change 'instruction', 'output' column names to 'user', 'assistant' and make it dictionary form
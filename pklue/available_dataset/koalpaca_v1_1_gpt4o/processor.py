@@ -1,14 +1,11 @@
-from datasets import Dataset
+from ...utils import convert_to_chat, load_dataset_max_examples
 
-from ...utils import load_dataset_max_examples
 
-
-def process(max_examples, split):
-    ds = load_dataset_max_examples("nlpai-lab/koalpaca_v1_1_gpt4o", split, max_examples)
+def process(max_examples, split, streaming=False):
+    ds = load_dataset_max_examples("nlpai-lab/koalpaca_v1_1_gpt4o", split, max_examples, streaming=streaming)
 
     # change 'prompt', 'completion' column names to 'user', 'assistant' and make it chat form
-    ds = Dataset.from_list([{
-        'chat': [('user', e['prompt']), ('assistant', e['completion'])]
-    } for e in ds])
+    ds = ds.select_columns(['prompt', 'completion'])
+    ds = convert_to_chat(ds)
 
     return ds
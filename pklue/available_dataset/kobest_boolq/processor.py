@@ -1,12 +1,11 @@
 from pathlib import Path
 
-import yaml
-
 from ...utils import convert_to_chat, _make_options_str, make_random_template_data, load_dataset_max_examples
+from ...templates import load_templates
 
 
-def process(max_examples, split):
-    ds = load_dataset_max_examples('skt/kobest_v1', split, max_examples, subset='boolq')
+def process(max_examples, split, streaming=False):
+    ds = load_dataset_max_examples('skt/kobest_v1', split, max_examples, subset='boolq', streaming=streaming)
 
     def adding_columns(example):
         label = example['label']
@@ -18,8 +17,7 @@ def process(max_examples, split):
         }
     new_ds = ds.map(adding_columns)
 
-    with open(Path(__file__).parent / "template.yaml", 'rt', encoding='utf-8') as f:
-        templates = yaml.load(f, Loader=yaml.BaseLoader)['kobest_boolq']
+    templates = load_templates(Path(__file__).parent / "template.yaml", 'kobest_boolq')
     new_ds = make_random_template_data(templates, new_ds)
 
     new_ds = convert_to_chat(new_ds)
@@ -1,12 +1,14 @@
 from pathlib import Path
 
-import yaml
+from ...utils import (
+    convert_to_chat, _make_options_str, make_lazy_template_chat, make_random_template_data, load_dataset_max_examples
+)
+from ...templates import load_templates
 
-from ...utils import convert_to_chat, _make_options_str, make_random_template_data, load_dataset_max_examples
 
-
-def process(max_examples, split):
-    ds = load_dataset_max_examples('skt/kobest_v1', split, max_examples, subset='hellaswag')
+def process(max_examples, split, streaming=False, lazy=False):
+    """lazy: keep the passages once and render chats on access. see utils.make_lazy_template_chat."""
+    ds = load_dataset_max_examples('skt/kobest_v1', split, max_examples, subset='hellaswag', streaming=streaming)
 
     # add 'options', 'answer' column to dataset
     new_ds = ds.map(
@@ -18,8 +20,9 @@ def process(max_examples, split):
         }
     )
 
-    with open(Path(__file__).parent / "template_hellaswag.yaml", 'rt', encoding='utf-8') as f:
-        templates = yaml.load(f, Loader=yaml.BaseLoader)['kobest_hellaswag']
+    templates = load_templates(Path(__file__).parent / "template_hellaswag.yaml", 'kobest_hellaswag')
+    if lazy and not streaming:
+        return make_lazy_template_chat(templates, new_ds)
     new_ds = make_random_template_data(templates, new_ds)
 
     new_ds = convert_to_chat(new_ds)
@@ -1,25 +1,24 @@
-from datasets import concatenate_datasets, load_dataset
+import pyarrow as pa
+from datasets import concatenate_datasets
 
+from ...chat import CHAT_FEATURES, alternating_chat
+from ...mirror import resolve_dataset
+from ...normalize import normalize_text
+from ...utils import subsample
 
-def process(max_examples, split):
-    ds = load_dataset('nlpai-lab/korean-multi-turn-gpt4-kullm')
+
+def process(max_examples, split, streaming=False):
+    ds = resolve_dataset('nlpai-lab/korean-multi-turn-gpt4-kullm', streaming=streaming)
 
     # concatenate ultrachat, aha, hand
     ds = concatenate_datasets([ds['ultrachat'], ds['aha'], ds['hand']])
 
-    if max_examples and max_examples < len(ds):
-        ds = ds.train_test_split(train_size=max_examples)['train']
+    ds = normalize_text(subsample(ds, max_examples))
 
-    # make it chat form
-    def worker(item):
-        chat = []
-        for i, utterance in enumerate(item['data']):
-            if i % 2 == 0:
-                turn = 'user'
-            else:
-                turn = 'assistant'
-            chat.append((turn, utterance))
-        return {'chat': chat}
-    ds = ds.map(worker, remove_columns=['data'])
+    # make it chat form. utterances alternate user and assistant
+    ds = ds.with_format('arrow').map(
+        lambda batch: pa.table({'chat': alternating_chat(batch.column('data'))}),
+        batched=True, remove_columns=['data'], features=CHAT_FEATURES,
+    ).with_format()
 
     return ds
@@ -1,15 +1,13 @@
 from pathlib import Path
 
-import yaml
-
 from ...utils import make_random_template_data, convert_to_chat, load_dataset_max_examples
+from ...templates import load_templates
 
 
-def process(max_examples, split):
-    ds = load_dataset_max_examples("heavytail/ko_commongenv2", split, max_examples)
+def process(max_examples, split, streaming=False):
+    ds = load_dataset_max_examples("heavytail/ko_commongenv2", split, max_examples, streaming=streaming)
 
-    with open(Path(__file__).parent / "template.yaml", 'rt', encoding='utf-8') as f:
-        templates = yaml.load(f, Loader=yaml.BaseLoader)['pseudo_commongen']
+    templates = load_templates(Path(__file__).parent / "template.yaml", 'pseudo_commongen')
 
     new_ds = make_random_template_data(templates, ds)
     new_ds = convert_to_chat(new_ds)
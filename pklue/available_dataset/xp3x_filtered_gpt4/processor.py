@@ -1,8 +1,8 @@
 from ...utils import convert_to_chat, load_dataset_max_examples
 
 
-def process(max_examples, split):
-    ds = load_dataset_max_examples('nlpai-lab/kullm3-xp3x-filtered-gpt4', split, max_examples)
+def process(max_examples, split, streaming=False):
+    ds = load_dataset_max_examples('nlpai-lab/kullm3-xp3x-filtered-gpt4', split, max_examples, streaming=streaming)
 
     # make it chat form
     ds = ds.rename_columns({
@@ -0,0 +1,315 @@
+# Copyright 2023 NLP & AI Lab - Korea University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""offline benchmark of processors and the mixture pipeline
+
+Every huggingface source is replaced by a local synthetic fixture with the same columns,
+laid out as a source mirror (see 'pklue.mirror'), so the benchmark never touches the network. Each case runs in a fresh process,
+and records wall time, peak RSS and rows/sec.
+
+Usage:
+    python -m pklue.benchmark --save baseline.json
+    python -m pklue.benchmark --baseline baseline.json  # exits with 1 on regression
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+import numpy as np
+
+from .mirror import resolve_dataset, source_path, use_mirror
+
+# columns of every source, as {column: kind}. see '_make_column' for the kinds.
+FIXTURE_SCHEMAS = {
+    ('vicgalle/alpaca-gpt4', None): {'instruction': 'text', 'input': 'optional_text', 'output': 'text'},
+    ('nlpai-lab/alpaca_gpt4_filtered', None): {'chat': 'chat'},
+    ('nlpai-lab/kullm3-alpaca-gpt4', None): {'instruction': 'text', 'output': 'text'},
+    ('heavytail/ko_arc', None): {'query': 'text', 'response': 'text'},
+    ('nlpai-lab/kullm3-aya', None): {'instruction': 'text', 'output': 'text'},
+    ('nlpai-lab/aya_ko_gpt4o', None): {'prompt': 'text', 'completion': 'text'},
+    ('nlpai-lab/crawled_q_and_a', None): {'prompt': 'text', 'completion': 'text'},
+    ('nlpai-lab/kullm3-dolly-gpt4', None): {'instruction': 'text', 'output': 'text'},
+    ('nlpai-lab/halluci_multiturn_gpt4o', None): {'chat': 'chat'},
+    ('klue', 'mrc'): {'title': 'text', 'context': 'passage', 'question': 'text', 'answers': 'answers'},
+    ('klue', 'nli'): {'premise': 'text', 'hypothesis': 'text', 'label': 'label:3'},
+    ('klue', 'sts'): {'sentence1': 'text', 'sentence2': 'text'},
+    ('klue', 'ynat'): {'title': 'text', 'label': 'label:7'},
+    ('beomi/KoAlpaca-v1.1a', None): {'instruction': 'text', 'output': 'text', 'url': 'text'},
+    ('nlpai-lab/koalpaca_v1_1_gpt4o', None): {'prompt': 'text', 'completion': 'text'},
+    ('skt/kobest_v1', 'boolq'): {'paragraph': 'passage', 'question': 'text', 'label': 'label:2'},
+    ('skt/kobest_v1', 'copa'): {
+        'premise': 'text', 'question': 'copa_question', 'alternative_1': 'text', 'alternative_2': 'text',
+        'label': 'label:2',
+    },
+    ('skt/kobest_v1', 'hellaswag'): {
+        'context': 'text', 'ending_1': 'text', 'ending_2': 'text', 'ending_3': 'text', 'ending_4': 'text',
+        'label': 'label:4',
+    },
+    ('skt/kobest_v1', 'sentineg'): {'sentence': 'text', 'label': 'label:2'},
+    ('skt/kobest_v1', 'wic'): {'word': 'word', 'context_1': 'text', 'context_2': 'text', 'label': 'label:2'},
+    ('nlpai-lab/korean-multi-turn-gpt4-kullm', None): {'data': 'turns'},
+    ('squad_kor_v1', None): {'title': 'text', 'context': 'passage', 'question': 'text', 'answers': 'answers'},
+    ('nlpai-lab/kullm3-personal-info', None): {'instruction': 'text', 'output': 'text'},
+    ('nlpai-lab/kullm-v2', None): {'id': 'text', 'instruction': 'text', 'input': 'optional_text', 'output': 'text'},
+    ('heavytail/ko_mmlu', None): {
+        'input': 'text', 'A': 'text', 'B': 'text', 'C': 'text', 'D': 'text', 'target': 'mmlu_target',
+    },
+    ('heavytail/ko_commongenv2', None): {'query': 'text', 'response': 'text'},
+    ('nlpai-lab/kullm3-square-gpt4-sampled', None): {'instruction': 'text', 'output': 'text'},
+    ('heavytail/ko_truthfulqa', None): {'query': 'text', 'response': 'text'},
+    ('nlpai-lab/truthfulqa_to_ko_gpt4o', None): {'prompt': 'text', 'completion': 'text'},
+    ('nlpai-lab/kullm3-xp3x-filtered-gpt4', None): {'instruction': 'text', 'answer': 'text'},
+}
+# sources which are loaded as a DatasetDict of these splits
+FIXTURE_SPLITS = {
+    'nlpai-lab/korean-multi-turn-gpt4-kullm': ['ultrachat', 'aha', 'hand'],
+}
+
+_FIRST_HANGUL = 0xAC00
+_N_HANGUL = 11172
+
+
+def _make_texts(rng: np.random.Generator, n, mean_chars):
+    """n random Hangul texts with spaces, about mean_chars long."""
+    lengths = rng.integers(max(mean_chars // 2, 1), mean_chars * 3 // 2 + 1, size=n)
+    codepoints = rng.integers(_FIRST_HANGUL, _FIRST_HANGUL + _N_HANGUL, size=int(lengths.sum()), dtype=np.uint32)
+    codepoints[rng.random(len(codepoints)) < 0.25] = ord(' ')
+    text = codepoints.tobytes().decode('utf-32-le')
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    return [text[offsets[i]:offsets[i + 1]] for i in range(n)]
+
+
+def _make_column(rng: np.random.Generator, kind, n):
+    if kind == 'text':
+        return _make_texts(rng, n, 80)
+    if kind == 'optional_text':
+        return [t if keep else '' for t, keep in zip(_make_texts(rng, n, 40), rng.random(n) < 0.5)]
+    if kind == 'passage':
+        return _make_texts(rng, n, 1500)
+    if kind == 'word':
+        return _make_texts(rng, n, 2)
+    if kind.startswith('label:'):
+        return rng.integers(int(kind.split(':')[1]), size=n).tolist()
+    if kind == 'copa_question':
+        return [['원인', '결과'][i] for i in rng.integers(2, size=n)]
+    if kind == 'mmlu_target':
+        return [['A', 'B', 'C', 'D'][i] for i in rng.integers(4, size=n)]
+    if kind == 'answers':
+        return [{'text': [t], 'answer_start': [0]} for t in _make_texts(rng, n, 10)]
+    if kind == 'turns':
+        turns = _make_texts(rng, 4 * n, 120)
+        return [turns[4 * i:4 * i + 4] for i in range(n)]
+    if kind == 'chat':
+        turns = _make_texts(rng, 2 * n, 120)
+        return [[['user', turns[2 * i]], ['assistant', turns[2 * i + 1]]] for i in range(n)]
+    raise ValueError(f"unknown fixture column kind: {kind}")
+
+
+def make_fixtures(fixture_dir, num_rows=20000, seed=0):
+    """write a synthetic Arrow fixture of every source under 'fixture_dir'."""
+    from datasets import Dataset, DatasetDict
+
+    rng = np.random.default_rng(seed)
+    for (hf_id, subset), schema in FIXTURE_SCHEMAS.items():
+        splits = FIXTURE_SPLITS.get(hf_id, ['train'])
+        ds_dict = DatasetDict({
+            split: Dataset.from_dict({c: _make_column(rng, kind, num_rows) for c, kind in schema.items()})
+            for split in splits
+        })
+        ds_dict.save_to_disk(str(source_path(fixture_dir, hf_id, subset)))
+
+
+def serve_fixtures(fixture_dir):
+    """make every source of pklue load from the fixtures instead of the hub."""
+    use_mirror(fixture_dir)
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 if sys.platform != 'darwin' else peak / 2 ** 20
+
+
+def _timed(name, stage, fn):
+    start = time.perf_counter()
+    rows = fn()
+    seconds = time.perf_counter() - start
+    return {
+        'name': name, 'stage': stage, 'seconds': seconds, 'rows': rows,
+        'rows_per_sec': rows / seconds if seconds > 0 else None, 'peak_rss_mb': _peak_rss_mb(),
+    }
+
+
+def _run_processor(fixture_dir, name, max_examples):
+    serve_fixtures(fixture_dir)
+    from .registry import load_processor
+
+    process = load_processor(name).process
+    return _timed(name, 'process', lambda: len(process(max_examples, 'train')))
+
+
+def _run_mixture(fixture_dir, names, max_examples):
+    serve_fixtures(fixture_dir)
+    from .pklue import get_mixture
+
+    # the case is named by its datasets and max_examples, so '--baseline' compares only the same mixture
+    name = f"mixture[{','.join(names)}] max_examples={max_examples}"
+    return _timed(name, 'get_mixture', lambda: len(get_mixture(names, max_examples=max_examples, seed=0)))
+
+
+def _run_stage(fixture_dir, stage, num_rows):
+    """micro benchmark of a single pipeline stage on the klue_mrc fixture, which has long passages."""
+    serve_fixtures(fixture_dir)
+    from datasets import Dataset
+    from . import templates as template_store
+    from . import utils
+    from .registry import DATASET_DIR
+
+    if stage in ('load_templates_cold', 'load_templates_warm'):
+        def load_all_templates():
+            store = template_store._store()
+            for name, compiled in store.items():
+                for key in compiled:
+                    template_store.load_templates(DATASET_DIR / name, key)
+            return len(store)
+
+        # a cache file of its own, so the user's cache is neither used nor replaced
+        with tempfile.TemporaryDirectory() as cache_dir:
+            template_store.CACHE_FILE = Path(cache_dir) / 'templates.pickle'
+            if stage == 'load_templates_warm':
+                template_store._store()
+                template_store._entries = None  # as in a new process, which reads the cache file
+            return _timed(stage, stage, load_all_templates)
+
+    ds = resolve_dataset('klue', 'mrc', split='train')
+    ds = ds.map(lambda e: {'answer': e['answers']['text'][0]}, remove_columns=['answers'])
+    templates = template_store.load_templates(DATASET_DIR / "klue_mrc" / "template_mrc.yaml", 'klue_mrc')
+
+    if stage == 'load_dataset_max_examples':
+        return _timed(stage, stage, lambda: len(
+            utils.load_dataset_max_examples('klue', 'train', num_rows // 2, subset='mrc')
+        ))
+    if stage == 'from_list':
+        rows = ds.to_list()
+        return _timed(stage, stage, lambda: len(Dataset.from_list(rows)))
+    if stage == 'make_random_template_data':
+        return _timed(stage, stage, lambda: len(utils.make_random_template_data(templates, ds)))
+    if stage == 'convert_to_chat':
+        rendered = utils.make_random_template_data(templates, ds)
+        return _timed(stage, stage, lambda: len(utils.convert_to_chat(rendered)))
+    raise ValueError(f"unknown stage: {stage}")
+
+
+STAGES = [
+    'load_dataset_max_examples', 'load_templates_cold', 'load_templates_warm', 'from_list',
+    'make_random_template_data', 'convert_to_chat',
+]
+
+
+def run_benchmark(fixture_dir, dataset_names: List[str] = None, max_examples=None, num_rows=20000) -> List[Dict]:
+    """Run every case in its own process, so peak RSS is measured per case.
+
+    Args:
+        fixture_dir: directory made by 'make_fixtures'.
+        dataset_names: processors to benchmark. defaults to every dataset with a hub source (hf_id), which excludes
+            generated ones like k_ipsum that have no source to load from fixtures.
+        max_examples: passed to every processor.
+        num_rows: rows of each fixture, used by the stage benchmarks.
+    """
+    from .registry import get_info, list_datasets
+
+    if dataset_names is None:
+        dataset_names = [n for n in list_datasets() if get_info(n).hf_id is not None]
+    cases = [(_run_stage, (fixture_dir, stage, num_rows)) for stage in STAGES]
+    cases += [(_run_processor, (fixture_dir, name, max_examples)) for name in dataset_names]
+    cases.append((_run_mixture, (fixture_dir, dataset_names, max_examples)))
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for fn, args in cases:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            results.append(pool.submit(fn, *args).result())
+    return results
+
+
+def compare(results, baseline, tolerance=0.2):
+    """cases whose wall time or peak RSS grew more than 'tolerance' over the baseline."""
+    baseline = {(r['name'], r['stage']): r for r in baseline}
+    regressions = []
+    for r in results:
+        base = baseline.get((r['name'], r['stage']))
+        if base is None:
+            continue
+        for metric in ('seconds', 'peak_rss_mb'):
+            if r[metric] is not None and base[metric] and r[metric] > base[metric] * (1 + tolerance):
+                regressions.append({**r, 'metric': metric, 'baseline': base[metric]})
+    return regressions
+
+
+def _print_results(results):
+    print(f"{'name':<32}{'stage':<28}{'seconds':>10}{'rows':>10}{'rows/sec':>12}{'peak MB':>10}")
+    for r in results:
+        rows_per_sec = f"{r['rows_per_sec']:.0f}" if r['rows_per_sec'] else '-'
+        rss = f"{r['peak_rss_mb']:.0f}" if r['peak_rss_mb'] else '-'
+        print(f"{r['name']:<32}{r['stage']:<28}{r['seconds']:>10.3f}{r['rows']:>10}{rows_per_sec:>12}{rss:>10}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="offline benchmark of pklue processors")
+    parser.add_argument('--datasets', nargs='*', help="processors to benchmark. defaults to every dataset.")
+    parser.add_argument('--max-examples', type=int, default=None)
+    parser.add_argument('--rows', type=int, default=20000, help="rows of each synthetic fixture.")
+    parser.add_argument('--fixture-dir', help="reuse fixtures in this directory. made in a temp dir if not given.")
+    parser.add_argument('--save', help="write results to this json file.")
+    parser.add_argument('--baseline', help="compare against results saved with --save.")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed relative growth over the baseline.")
+    args = parser.parse_args(argv)
+
+    os.environ['HF_DATASETS_OFFLINE'] = '1'
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fixture_dir = args.fixture_dir or tmp_dir
+        Path(fixture_dir).mkdir(parents=True, exist_ok=True)
+        if not any(Path(fixture_dir).iterdir()):
+            make_fixtures(fixture_dir, args.rows)
+        results = run_benchmark(fixture_dir, args.datasets, args.max_examples, args.rows)
+    _print_results(results)
+
+    if args.save:
+        with open(args.save, 'wt', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'rt', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for r in regressions:
+            print(f"REGRESSION {r['name']}/{r['stage']}: {r['metric']} {r[r['metric']]:.3f} > {r['baseline']:.3f}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,198 @@
+# Copyright 2023 NLP & AI Lab - Korea University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""content-addressed on-disk cache of processed datasets
+
+A processed dataset is keyed by its arguments and by everything it depends on: its processor, manifest and
+templates, the shared package code, and the mirrored source data (see pklue.mirror). 'DatasetCache' keeps entries
+of any key, and 'BuildDirectory' keeps only the latest shard of every dataset of a mixture for incremental rebuilds.
+"""
+
+from pathlib import Path
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+from datasets import Dataset, load_from_disk
+
+from .mirror import source_fingerprint as source_data_fingerprint
+from .normalize import TextNormalization
+from .registry import get_info
+
+PACKAGE_DIR = Path(__file__).parent
+# package modules whose code changes the output of every processor, including how sources are resolved
+SHARED_SOURCES = (
+    'utils.py', 'korean_utils.py', 'dedup.py', 'chat.py', 'templates.py', 'rng.py', 'quality.py', 'normalize.py',
+    'synthetic.py', 'mirror.py', 'registry.py',
+)
+
+
+def _hash_files(paths):
+    h = hashlib.sha256()
+    for path in paths:
+        h.update(path.name.encode('utf-8'))
+        h.update(path.read_bytes())
+    return h.hexdigest()
+
+
+def source_fingerprint(dataset_name):
+    """hash of a dataset's processor.py, manifest.yaml and template*.yaml, plus the shared package code."""
+    dataset_dir = PACKAGE_DIR / "available_dataset" / dataset_name
+    own_files = [dataset_dir / "processor.py", dataset_dir / "manifest.yaml"]
+    own_files += sorted(dataset_dir.glob("template*.yaml"))
+    shared_files = [PACKAGE_DIR / name for name in SHARED_SOURCES]
+    return _hash_files(own_files + shared_files)
+
+
+def cache_key(dataset_name, split, max_examples, seed, quality=None, normalization=TextNormalization()):
+    info = get_info(dataset_name)
+    key = {
+        'dataset_name': dataset_name,
+        'split': split,
+        'max_examples': max_examples,
+        'seed': seed,
+        'source': source_fingerprint(dataset_name),
+        'data': source_data_fingerprint(info.hf_id, info.subset) if info.hf_id else None,
+        'quality': quality._asdict() if quality is not None else None,
+        'normalization': normalization._replace(num_proc=None)._asdict() if normalization is not None else None,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _dir_size(path):
+    return sum(f.stat().st_size for f in Path(path).rglob("*") if f.is_file())
+
+
+class DatasetCache:
+    """Stores processed datasets as Arrow files under 'cache_dir/<dataset_name>/<key>/'.
+
+    Hits are loaded back with 'load_from_disk', which memory-maps the Arrow files.
+    Entries are evicted least-recently-used first once the cache grows over 'max_bytes'.
+    """
+    META_FILE = "pklue_cache.json"
+
+    def __init__(self, cache_dir, max_bytes=None):
+        self.cache_dir = Path(cache_dir).expanduser()
+        self.max_bytes = max_bytes
+
+    def _entry_dir(self, dataset_name, key):
+        return self.cache_dir / dataset_name / key
+
+    def load(self, dataset_name, key):
+        entry_dir = self._entry_dir(dataset_name, key)
+        if not (entry_dir / self.META_FILE).exists():
+            return None
+        os.utime(entry_dir / self.META_FILE)  # mark as recently used
+        return load_from_disk(str(entry_dir / "data"))
+
+    def save(self, dataset_name, key, ds: Dataset) -> Dataset:
+        """write 'ds' to the cache and return the memory-mapped copy."""
+        entry_dir = self._entry_dir(dataset_name, key)
+        tmp_dir = self.cache_dir / dataset_name / f".tmp-{uuid.uuid4().hex}"
+        ds.save_to_disk(str(tmp_dir / "data"))
+        fingerprint = source_fingerprint(dataset_name)
+        with open(tmp_dir / self.META_FILE, 'wt', encoding='utf-8') as f:
+            json.dump({'source': fingerprint, 'num_bytes': _dir_size(tmp_dir)}, f)
+        if entry_dir.exists():  # written concurrently by another build
+            shutil.rmtree(tmp_dir)
+        else:
+            os.replace(tmp_dir, entry_dir)
+        self._remove_stale(dataset_name, fingerprint)
+        return load_from_disk(str(entry_dir / "data"))
+
+    def _entries(self):
+        for meta_file in self.cache_dir.glob(f"*/*/{self.META_FILE}"):
+            with open(meta_file, 'rt', encoding='utf-8') as f:
+                yield meta_file.parent, json.load(f), meta_file.stat().st_mtime
+
+    def _remove_stale(self, dataset_name, fingerprint):
+        """entries made from an older processor or template can never be hit again."""
+        for entry_dir, meta, _ in list(self._entries()):
+            if entry_dir.parent.name == dataset_name and meta['source'] != fingerprint:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+
+    def evict(self, keep=None):
+        """remove least recently used entries until the cache fits in max_bytes.
+
+        keep: {dataset_name: key} of entries which are never removed, like those memory-mapped by the current
+            build. the cache can stay over max_bytes if they alone do not fit.
+        """
+        if self.max_bytes is None:
+            return
+        kept_dirs = {self._entry_dir(name, key) for name, key in (keep or {}).items()}
+        entries = sorted(self._entries(), key=lambda e: e[2])  # least recently used first
+        total = sum(meta['num_bytes'] for _, meta, _ in entries)
+        for entry_dir, meta, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if entry_dir in kept_dirs:
+                continue
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= meta['num_bytes']
+
+
+class BuildDirectory(DatasetCache):
+    """Persistent build of a mixture: one memory-mapped Arrow shard per dataset, with 'build.json'.
+
+    A rebuild loads every dataset whose key is unchanged and reprocesses only the stale ones, whose processor,
+    templates, shared code, mirrored source or arguments have changed. The new shard replaces the previous one,
+    so the directory never grows beyond one shard per dataset. On a shared filesystem, ranks of a distributed
+    job can each write some of the shards and 'wait' for the others.
+    """
+    MANIFEST_FILE = "build.json"
+
+    def __init__(self, build_dir):
+        super().__init__(build_dir)
+
+    def save(self, dataset_name, key, ds: Dataset) -> Dataset:
+        ds = super().save(dataset_name, key, ds)
+        for entry_dir in (self.cache_dir / dataset_name).iterdir():
+            if entry_dir.name != key and (entry_dir / self.META_FILE).exists():
+                shutil.rmtree(entry_dir, ignore_errors=True)
+        return ds
+
+    def wait(self, keys, timeout=None, interval=1.0):
+        """block until the shard of every {dataset_name: key} is written, by this or another process."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        missing = dict(keys)
+        while True:
+            missing = {name: key for name, key in missing.items()
+                       if not (self._entry_dir(name, key) / self.META_FILE).exists()}
+            if not missing:
+                return
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"shards of {sorted(missing)} were not written in {timeout} seconds.")
+            time.sleep(interval)
+
+    def write_manifest(self, dataset_names, split, max_examples, seed, quality, normalizations, rows=None):
+        """record the shards of the last build, in the order of 'dataset_names'.
+        quality and normalizations are {name: QualityFilter} and {name: TextNormalization}.
+        rows, if given, is the number of rows of every shard, which is recorded with their offsets
+        in the concatenated mixture."""
+        shards = {}
+        offset = 0
+        for i, name in enumerate(dataset_names):
+            key = cache_key(name, split, max_examples, seed, quality.get(name), normalizations[name])
+            shards[name] = {'key': key, 'path': str(self._entry_dir(name, key).relative_to(self.cache_dir))}
+            if rows is not None:
+                shards[name].update(rows=rows[i], offset=offset)
+                offset += rows[i]
+        manifest = {'split': split, 'max_examples': max_examples, 'seed': seed, 'datasets': shards}
+        tmp_path = self.cache_dir / f".{self.MANIFEST_FILE}.{uuid.uuid4().hex}"
+        with open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.cache_dir / self.MANIFEST_FILE)
@@ -0,0 +1,145 @@
+# Copyright 2023 NLP & AI Lab - Korea University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""arrow-native chat column
+
+'chat' column is list<struct<role: int8, content: large_string>>, where role is an index of ROLES.
+Chats are built with arrow kernels on whole columns, and read without decoding rows into python objects.
+
+Example:
+    >>> arrays = chat_arrays(get_mixture(['kullm_v2']).flatten_indices())
+    >>> arrays.contents[arrays.offsets[0]:arrays.offsets[1]]  # turns of the first chat
+"""
+
+from typing import List, NamedTuple, Sequence, Tuple, Union
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from datasets import Dataset, Features
+
+ROLES = ('system', 'user', 'assistant')
+USER, ASSISTANT = ROLES.index('user'), ROLES.index('assistant')
+TURN_TYPE = pa.struct([('role', pa.int8()), ('content', pa.large_string())])
+CHAT_TYPE = pa.list_(TURN_TYPE)
+CHAT_FEATURES = Features.from_arrow_schema(pa.schema([('chat', CHAT_TYPE)]))
+
+ArrowColumn = Union[pa.Array, pa.ChunkedArray]
+
+
+def _combine(column: ArrowColumn):
+    return column.combine_chunks() if isinstance(column, pa.ChunkedArray) else column
+
+
+def chat_array(offsets, roles, contents) -> pa.ListArray:
+    """chat column from flat turns. chat i is turns offsets[i]:offsets[i + 1]."""
+    turns = pa.StructArray.from_arrays(
+        [pa.array(np.asarray(roles, dtype=np.int8)), pc.cast(_combine(contents), pa.large_string())],
+        fields=list(TURN_TYPE),
+    )
+    return pa.ListArray.from_arrays(pa.array(np.asarray(offsets, dtype=np.int32)), turns, type=CHAT_TYPE)
+
+
+def pair_chat(prompts: ArrowColumn, completions: ArrowColumn) -> pa.ListArray:
+    """2-turn chats of [user: prompt, assistant: completion], interleaving the two columns with one 'take'."""
+    n = len(prompts)
+    both = pa.concat_arrays([pc.cast(_combine(prompts), pa.large_string()),
+                             pc.cast(_combine(completions), pa.large_string())])
+    interleaved = np.stack([np.arange(n), np.arange(n) + n], axis=1).ravel()
+    return chat_array(np.arange(n + 1) * 2, np.tile([USER, ASSISTANT], n), pc.take(both, interleaved))
+
+
+def alternating_chat(utterances: ArrowColumn) -> pa.ListArray:
+    """chats from list<string> columns of utterances, which alternate user and assistant starting from user."""
+    utterances = _combine(utterances)
+    offsets = pc.subtract(utterances.offsets, utterances.offsets[0]).to_numpy()
+    turn_index = np.arange(offsets[-1]) - np.repeat(offsets[:-1], np.diff(offsets))
+    roles = np.where(turn_index % 2 == 0, USER, ASSISTANT)
+    return chat_array(offsets, roles, utterances.flatten())
+
+
+def from_pairs(chats: ArrowColumn) -> pa.ListArray:
+    """convert list<list<string>> column of [role, content] pairs, the previous chat format, to a chat column."""
+    chats = _combine(chats)
+    pairs = chats.flatten()
+    roles = pc.index_in(pc.list_element(pairs, 0), value_set=pa.array(ROLES))
+    assert roles.null_count == 0, f"every role must be one of {ROLES}."
+    offsets = pc.subtract(chats.offsets, chats.offsets[0]).to_numpy()
+    return chat_array(offsets, roles.to_numpy(), pc.list_element(pairs, 1))
+
+
+def from_tuples(chats: Sequence[Sequence[Tuple[str, str]]]) -> pa.ListArray:
+    """chat column from python chats like [[('user', '...'), ('assistant', '...')], ...]."""
+    offsets = np.cumsum([0] + [len(chat) for chat in chats])
+    roles = [ROLES.index(role) for chat in chats for role, _ in chat]
+    contents = pa.array([content for chat in chats for _, content in chat], type=pa.large_string())
+    return chat_array(offsets, roles, contents)
+
+
+def to_tuples(chats: Union[ArrowColumn, Dataset]) -> List[List[Tuple[str, str]]]:
+    """python chats like [[('user', '...'), ('assistant', '...')], ...] of a chat column or of a dataset's
+    'chat' column, in the row order of a 'select()' view. see 'chat_arrays'."""
+    arrays = chat_arrays(chats)
+    roles = [ROLES[r] for r in arrays.roles.tolist()]
+    turns = list(zip(roles, arrays.contents.to_pylist()))
+    offsets = arrays.offsets.tolist()
+    return [turns[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def chat_column(ds: Dataset, indices=None) -> pa.ChunkedArray:
+    """'chat' column of a dataset, or its rows at 'indices', gathered with one arrow 'take'.
+
+    the indices mapping of a 'select()' view is composed with 'indices' first,
+    which is much faster than formatting the rows of the view.
+    """
+    column = ds.data.column('chat')
+    if ds._indices is not None:
+        mapping = ds._indices.column(0).to_numpy()
+        indices = mapping if indices is None else mapping[indices]
+    return column if indices is None else column.take(indices)
+
+
+def group_chats(chats: ArrowColumn, group_sizes) -> pa.ListArray:
+    """join consecutive chats, so that chat i of the result is the next group_sizes[i] chats in order.
+    only the offsets are recomputed. the turns are shared with 'chats'."""
+    arrays = chat_arrays(chats)
+    boundaries = np.concatenate([[0], np.cumsum(group_sizes, dtype=np.int64)])
+    assert boundaries[-1] <= len(arrays.offsets) - 1, "group sizes sum to more than the number of chats."
+    num_turns = arrays.offsets[boundaries[-1]]
+    return chat_array(arrays.offsets[boundaries], arrays.roles[:num_turns], arrays.contents[:num_turns])
+
+
+class ChatArrays(NamedTuple):
+    """flat turns of a chat column. chat i is turns offsets[i]:offsets[i + 1]."""
+    offsets: np.ndarray  # int32, rebased to start at 0
+    roles: np.ndarray  # int8 index of ROLES
+    contents: pa.LargeStringArray
+
+
+def chat_arrays(chats: Union[ArrowColumn, Dataset]) -> ChatArrays:
+    """flat turns of a chat column or of a dataset's 'chat' column.
+
+    roles and contents share the arrow buffers without copying. a Dataset with an indices mapping,
+    like a 'select()' view, is gathered first, so call 'flatten_indices()' once when reading it repeatedly.
+    """
+    if isinstance(chats, Dataset):
+        chats = chat_column(chats)
+    chats = _combine(chats)
+    turns = chats.flatten()
+    offsets = chats.offsets.to_numpy()
+    return ChatArrays(
+        offsets - offsets[0],
+        turns.field('role').to_numpy(zero_copy_only=False),
+        turns.field('content'),
+    )
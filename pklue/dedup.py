@@ -0,0 +1,275 @@
+# Copyright 2023 NLP & AI Lab - Korea University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""exact and near-duplicate deduplication of datasets
+
+Only a fixed number of integers per row (one hash, or a MinHash signature of 32-bit values) is kept in memory,
+so deduplicating the whole mixture does not hold any row text. Text is normalized with arrow kernels, and
+MinHash signatures are computed with numpy over whole batches; exact hashes are one blake2b digest per row.
+Near-duplicate candidates which share an LSH band are verified against their signatures before they are merged.
+"""
+
+from hashlib import blake2b
+from typing import List, Union
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from datasets import Dataset, IterableDataset, concatenate_datasets
+
+from .chat import ROLES, chat_arrays
+
+_SHINGLE_BASE = np.uint64(1_000_003)
+
+
+def _join_chat(chat):
+    """'role content\nrole content ...' string of every chat in a chat column."""
+    arrays = chat_arrays(chat)
+    roles = pc.take(pa.array(ROLES, type=pa.large_string()), arrays.roles)
+    turns = pc.binary_join_element_wise(roles, arrays.contents, pa.scalar(' ', pa.large_string()))
+    return pc.binary_join(pa.ListArray.from_arrays(pa.array(arrays.offsets), turns), pa.scalar('\n', pa.large_string()))
+
+
+def normalized_text(batch: pa.Table, columns):
+    """NFKC-normalized, lower-cased, whitespace-collapsed text of 'columns' in each row."""
+    texts = [
+        _join_chat(batch.column(c)) if c == 'chat' else pc.cast(batch.column(c), pa.large_string()) for c in columns
+    ]
+    text = texts[0] if len(texts) == 1 else pc.binary_join_element_wise(*texts, pa.scalar('\n', pa.large_string()))
+    text = pc.utf8_lower(pc.utf8_normalize(pc.fill_null(text, ''), 'NFKC'))
+    return pc.utf8_trim_whitespace(pc.replace_substring_regex(text, r'\s+', ' '))
+
+
+def _hash64(data):
+    return int.from_bytes(blake2b(data, digest_size=8).digest(), 'little')
+
+
+def _utf8(text: Union[pa.LargeStringArray, pa.ChunkedArray]):
+    """(offsets, utf-8 bytes) of a large string array. string i is data[offsets[i]:offsets[i + 1]]."""
+    if isinstance(text, pa.ChunkedArray):
+        text = text.combine_chunks()
+    _, offsets_buffer, data_buffer = text.buffers()
+    offsets = np.frombuffer(offsets_buffer, dtype=np.int64)[text.offset:text.offset + len(text) + 1]
+    data = memoryview(data_buffer)[offsets[0]:offsets[-1]] if data_buffer else memoryview(b'')
+    return offsets - offsets[0], data
+
+
+def _exact_hashes(batch: pa.Table, columns):
+    """one blake2b digest per row, read from the utf-8 buffer of the normalized text without decoding it.
+    this is the only step which runs per row in python; normalization runs on the whole batch."""
+    offsets, data = _utf8(normalized_text(batch, columns))
+    offsets = offsets.tolist()
+    hashes = [_hash64(data[start:end]) for start, end in zip(offsets[:-1], offsets[1:])]
+    return pa.table({'hash': pa.array(hashes, type=pa.uint64())})
+
+
+def _integrate(f, start, end, steps=1000):
+    x = np.linspace(start, end, steps + 1)
+    y = f(x)
+    return float(((y[1:] + y[:-1]) / 2).sum() * (end - start) / steps)
+
+
+def _lsh_params(num_perm, threshold, false_positive_weight=0.1, false_negative_weight=0.9):
+    """(bands, rows) with bands * rows <= num_perm, minimizing the weighted areas of false positives below
+    'threshold' and false negatives above it under the LSH S-curve 1 - (1 - s ** rows) ** bands, as datasketch does.
+
+    Candidate pairs are verified against their signatures, so false positives only cost a comparison,
+    and false negatives are weighted more to keep the recall around 'threshold' high.
+    """
+    best, best_error = None, float('inf')
+    for bands in range(1, num_perm + 1):
+        for rows in range(1, num_perm // bands + 1):
+            false_positive = _integrate(lambda s: 1 - (1 - s ** rows) ** bands, 0.0, threshold)
+            false_negative = _integrate(lambda s: (1 - s ** rows) ** bands, threshold, 1.0)
+            error = false_positive_weight * false_positive + false_negative_weight * false_negative
+            if error < best_error:
+                best, best_error = (bands, rows), error
+    return best
+
+
+def _mix64(x: np.ndarray) -> np.ndarray:
+    """splitmix64 finalizer, with wrapping uint64 arithmetic."""
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def _shingles(text: Union[pa.LargeStringArray, pa.ChunkedArray], ngram):
+    """polynomial hashes of the character n-grams of every string, and the offset of each string's n-grams.
+    strings shorter than 'ngram' are padded with zeros, so every string has at least one n-gram."""
+    lengths = pc.utf8_length(text).to_numpy(zero_copy_only=False).astype(np.int64)
+    _, data = _utf8(text)
+    # one decode of the whole batch
+    codepoints = np.frombuffer(str(data, 'utf-8').encode('utf-32-le'), dtype=np.uint32)
+    padded_lengths = np.maximum(lengths, ngram)
+    padded_starts = np.cumsum(padded_lengths) - padded_lengths
+    padded = np.zeros(int(padded_lengths.sum()), dtype=np.uint64)
+    row_of_char = np.repeat(np.arange(len(lengths)), lengths)
+    padded[padded_starts[row_of_char] + np.arange(len(codepoints)) - (np.cumsum(lengths) - lengths)[row_of_char]] = \
+        codepoints
+    num_windows = len(padded) - ngram + 1
+    shingles = np.zeros(max(num_windows, 0), dtype=np.uint64)
+    for k in range(ngram):  # polynomial hash of every n-gram at once
+        shingles = shingles * _SHINGLE_BASE + padded[k:num_windows + k]
+    # n-grams which start in a string and end in the next one are dropped
+    counts = padded_lengths - ngram + 1
+    window_row = np.repeat(np.arange(len(lengths)), padded_lengths)[:num_windows]
+    valid = np.arange(num_windows) - padded_starts[window_row] < counts[window_row]
+    return shingles[valid], np.cumsum(counts) - counts
+
+
+def _minhash_signatures(batch: pa.Table, columns, ngram, perm_a, perm_b):
+    """MinHash signature of character n-grams of every row, as the high 32 bits of each minimum.
+
+    n-grams of the whole batch are hashed at once with wrapping uint64 arithmetic, and the minimum of each row
+    is taken with 'np.minimum.reduceat', a few permutations at a time to bound the memory.
+    """
+    text = normalized_text(batch, columns)
+    signatures = np.zeros((len(perm_a), len(batch)), dtype=np.uint32)
+    shingles, starts = _shingles(text, ngram)
+    step = max(1, 2 ** 23 // max(len(shingles), 1))
+    for i in range(0, len(perm_a) if len(batch) else 0, step):
+        hashed = np.outer(perm_a[i:i + step], shingles) + perm_b[i:i + step, None]
+        signatures[i:i + step] = np.minimum.reduceat(hashed, starts, axis=1) >> np.uint64(32)
+    return pa.table({
+        'signature': pa.FixedSizeListArray.from_arrays(pa.array(signatures.T.ravel()), len(perm_a)),
+    })
+
+
+def _band_hashes(signatures: np.ndarray, bands, rows):
+    """one 64-bit hash of every LSH band of every signature."""
+    band_hashes = np.zeros((len(signatures), bands), dtype=np.uint64)
+    for k in range(rows):
+        band_hashes = _mix64(band_hashes ^ signatures[:, k:bands * rows:rows].astype(np.uint64))
+    return band_hashes
+
+
+def _candidate_pairs(band_hashes: np.ndarray):
+    """(rows, first rows) of every band bucket with more than one row, pairing each row with the first of its bucket."""
+    pairs = []
+    for b in range(band_hashes.shape[1]):
+        order = np.argsort(band_hashes[:, b], kind='stable')
+        sorted_hashes = band_hashes[order, b]
+        bucket_start = np.flatnonzero(np.concatenate([[True], sorted_hashes[1:] != sorted_hashes[:-1]]))
+        first = np.repeat(order[bucket_start], np.diff(np.append(bucket_start, len(order))))
+        pairs.append(np.stack([order, first])[:, order != first])
+    pairs = np.concatenate(pairs, axis=1) if pairs else np.zeros((2, 0), dtype=np.int64)
+    return np.unique(pairs, axis=1) if pairs.size else pairs
+
+
+def _cluster_min_index(num_rows, edges: np.ndarray):
+    """smallest row index of the connected component of every row, given edges as a (2, n) array of rows."""
+    label = np.arange(num_rows)
+    u, v = edges
+    while True:  # min-label propagation with pointer jumping until every component agrees
+        new_label = label.copy()
+        np.minimum.at(new_label, u, label[v])
+        np.minimum.at(new_label, v, label[u])
+        new_label = new_label[new_label]
+        if (new_label == label).all():
+            return label
+        label = new_label
+
+
+def duplicate_mask(
+        ds: Dataset,
+        columns: List[str] = None,
+        near: bool = False,
+        threshold: float = 0.8,
+        num_perm: int = 128,
+        ngram: int = 5,
+        num_proc: int = None,
+        batch_size: int = 1000,
+        seed: int = 0,
+) -> np.ndarray:
+    """boolean mask which is True for every row to keep. the first row of each duplicate group is kept.
+
+    Args:
+        ds: dataset to deduplicate.
+        columns: columns compared. defaults to ['chat'].
+        near: if True, rows whose character n-gram Jaccard similarity is about 'threshold' or higher
+            are detected with MinHash LSH. otherwise rows with the same normalized text are duplicates.
+        threshold: similarity threshold of near-duplicate detection.
+        num_perm: the number of MinHash permutations.
+        ngram: character n-gram size of near-duplicate detection.
+        num_proc: the number of processes hashing rows.
+        batch_size: rows hashed at once.
+        seed: seed of MinHash permutations.
+    """
+    columns = columns or ['chat']
+    if len(ds) == 0:  # the batched maps below add no column to an empty dataset
+        return np.ones(0, dtype=bool)
+    source = ds.select_columns(columns).with_format('arrow')
+    if not near:
+        hashes = source.map(
+            _exact_hashes, fn_kwargs={'columns': columns}, batched=True, batch_size=batch_size,
+            remove_columns=columns, num_proc=num_proc,
+        ).data.column('hash').to_numpy()
+        keep = np.zeros(len(ds), dtype=bool)
+        keep[np.unique(hashes, return_index=True)[1]] = True
+        return keep
+
+    bands, rows = _lsh_params(num_perm, threshold)
+    rng = np.random.default_rng(seed)
+    perm_a = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)  # odd
+    perm_b = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+    signature_column = source.map(
+        _minhash_signatures,
+        fn_kwargs={'columns': columns, 'ngram': ngram, 'perm_a': perm_a, 'perm_b': perm_b},
+        batched=True, batch_size=batch_size, remove_columns=columns, num_proc=num_proc,
+    ).data.column('signature').combine_chunks()
+    signatures = signature_column.flatten().to_numpy().reshape(-1, num_perm)
+    # rows sharing a band bucket are duplicates only if their signatures agree on 'threshold' of the permutations
+    candidates = _candidate_pairs(_band_hashes(signatures, bands, rows))
+    similarity = (signatures[candidates[0]] == signatures[candidates[1]]).mean(axis=1)
+    edges = candidates[:, similarity >= threshold]
+    return _cluster_min_index(len(ds), edges) == np.arange(len(ds))
+
+
+def _iter_deduplicated(ds: IterableDataset, columns, batch_size=1000):
+    seen = set()  # new for every pass over the dataset. about 70 bytes of python objects per distinct row
+    for batch in ds.with_format('arrow').iter(batch_size=batch_size):
+        hashes = _exact_hashes(batch.select(columns), columns).column('hash').to_pylist()
+        for h, row in zip(hashes, batch.to_pylist()):
+            if h not in seen:
+                seen.add(h)
+                yield row
+
+
+def deduplicate(ds: Union[Dataset, IterableDataset], columns: List[str] = None, near: bool = False, **kwargs):
+    """Remove duplicated rows of 'ds'. see 'duplicate_mask' for arguments.
+
+    Returns 'select()' view of the kept rows. IterableDataset supports exact deduplication only,
+    and keeps the hash of every distinct row seen so far in a python set, so its memory grows with the number
+    of distinct rows by about 70 bytes each, e.g. 0.7 GB for 10M rows.
+    """
+    columns = columns or ['chat']
+    if isinstance(ds, IterableDataset):
+        assert not near, "near-duplicate detection needs the whole dataset, so it is not available for streaming."
+        return IterableDataset.from_generator(
+            _iter_deduplicated, features=ds.features, gen_kwargs={'ds': ds, 'columns': columns}
+        )
+
+    return ds.select(np.flatnonzero(duplicate_mask(ds, columns, near, **kwargs)))
+
+
+def deduplicate_datasets(datasets: List[Dataset], columns: List[str] = None, near: bool = False, **kwargs):
+    """Remove duplicates across 'datasets', keeping the first occurrence. Returns a view of each dataset."""
+    keep = duplicate_mask(concatenate_datasets(datasets), columns, near, **kwargs)
+    deduplicated = []
+    offset = 0
+    for ds in datasets:
+        deduplicated.append(ds.select(np.flatnonzero(keep[offset:offset + len(ds)])))
+        offset += len(ds)
+    return deduplicated
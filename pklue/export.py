@@ -0,0 +1,282 @@
+# Copyright 2023 NLP & AI Lab - Korea University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""export processed datasets to sharded Parquet or JSONL files
+
+Every dataset is processed and written by its own worker, batch by batch, into shards of about
+'max_shard_bytes' compressed bytes. With 'cache_dir', processed datasets are memory-mapped arrow files, and when
+streaming they are iterables, so peak memory depends on the batch size and the number of workers, not on the
+size of the mixture. Otherwise processors which build their output in memory, like merged multiturn chats or
+synthetic ones, hold each processed dataset whole in its worker while it is written.
+'manifest.json' lists every shard with its rows and sha256. Shards are written to a temporary directory and
+moved into the output directory once every dataset is written, so a failed export leaves the previous one intact.
+
+Usage:
+    python -m pklue.export kullm_v2 klue_nli --output-dir mixture --format parquet --seed 42
+"""
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import uuid
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .cache import DatasetCache
+from .instrument import stage
+from .normalize import TextNormalization
+from .pklue import _normalizations, _process_dataset, _quality_filters
+from .registry import list_datasets
+
+MANIFEST_FILE = 'manifest.json'
+JSONL_EXTENSIONS = {None: '.jsonl', 'gzip': '.jsonl.gz', 'zstd': '.jsonl.zst', 'bz2': '.jsonl.bz2'}
+
+
+def _sha256(path, chunk_size=2 ** 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class _ShardWriter:
+    """write arrow batches to numbered shard files, starting a new shard once one reaches max_shard_bytes."""
+
+    def __init__(self, output_dir: Path, prefix, file_format, compression, max_shard_bytes):
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.file_format = file_format
+        self.compression = compression
+        self.max_shard_bytes = max_shard_bytes
+        self.shards = []
+        self.sink = self.writer = None
+
+    def _open(self, schema):
+        extension = '.parquet' if self.file_format == 'parquet' else JSONL_EXTENSIONS[self.compression]
+        self.path = self.output_dir / f"{self.prefix}-{len(self.shards):05d}{extension}"
+        self.rows = 0
+        self.sink = pa.OSFile(str(self.path), 'wb')
+        if self.file_format == 'parquet':
+            self.writer = pq.ParquetWriter(self.sink, schema, compression=self.compression or 'none')
+        elif self.compression:
+            self.writer = pa.CompressedOutputStream(self.sink, self.compression)
+        else:
+            self.writer = self.sink
+
+    def _close(self):
+        self.writer.close()
+        if not self.sink.closed:
+            self.sink.close()
+        self.shards.append({
+            'path': self.path.name, 'rows': self.rows,
+            'bytes': self.path.stat().st_size, 'sha256': _sha256(self.path),
+        })
+        self.sink = self.writer = None
+
+    def _rows_that_fit(self, batch: pa.Table):
+        """rows of 'batch' which fit in the rest of the shard, estimated from the compressed bytes per row
+        written so far, or from the arrow size of the batch, which is larger, before anything is written."""
+        written_rows = sum(s['rows'] for s in self.shards) + self.rows
+        written_bytes = sum(s['bytes'] for s in self.shards) + self.sink.tell()
+        if written_rows and written_bytes:
+            bytes_per_row = written_bytes / written_rows
+        else:
+            bytes_per_row = batch.nbytes / len(batch)
+        return max(1, min(len(batch), int((self.max_shard_bytes - self.sink.tell()) / max(bytes_per_row, 1e-9))))
+
+    def write(self, batch: pa.Table):
+        """write 'batch', split across shards so that a shard exceeds max_shard_bytes only by the error
+        of the estimated bytes per row."""
+        while len(batch):
+            if self.sink is None:
+                self._open(batch.schema)
+            rows = self._rows_that_fit(batch)
+            part, batch = batch.slice(0, rows), batch.slice(rows)
+            if self.file_format == 'parquet':
+                self.writer.write_table(part)
+            else:
+                lines = ''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in part.to_pylist())
+                self.writer.write(lines.encode('utf-8'))
+            self.rows += len(part)
+            if self.sink.tell() >= self.max_shard_bytes or len(batch):  # the rest of the batch did not fit
+                self._close()
+
+    def close(self):
+        if self.sink is not None:
+            self._close()
+        return self.shards
+
+
+def _export_dataset(dataset_name, output_dir, file_format, compression, max_shard_bytes, batch_size,
+                    max_examples, split, seed, cache, streaming, quality, normalization):
+    ds = _process_dataset(dataset_name, max_examples, split, seed, cache, streaming, quality, normalization)
+    writer = _ShardWriter(Path(output_dir), dataset_name, file_format, compression, max_shard_bytes)
+    with stage('export'):
+        for batch in ds.with_format('arrow').iter(batch_size=batch_size):
+            writer.write(batch)
+        shards = writer.close()
+    return {'rows': sum(s['rows'] for s in shards), 'shards': shards}
+
+
+def export_mixture(
+        dataset_names: List[str],
+        output_dir: str,
+        file_format: str = 'parquet',
+        compression: str = 'zstd',
+        max_shard_bytes: int = 256 * 2 ** 20,
+        batch_size: int = 10000,
+        max_examples: int = None,
+        split: str = 'train',
+        num_workers: int = 1,
+        executor: str = 'process',
+        seed: int = None,
+        cache_dir: str = None,
+        streaming: bool = False,
+        quality=None,
+        normalize=TextNormalization(),
+) -> Dict:
+    """Process datasets and write them to shards of 'output_dir', with 'manifest.json'.
+
+    Args:
+        dataset_names: list of dataset names. see 'get_mixture'.
+        output_dir: directory of the shards and the manifest. created if it does not exist.
+        file_format: 'parquet' or 'jsonl'.
+        compression: parquet codec like 'zstd' or 'snappy', or 'gzip', 'zstd', 'bz2' stream for jsonl. None to disable.
+        max_shard_bytes: a batch is split so that each shard gets about this many bytes on disk. the split is
+            estimated from the compressed bytes per row written so far, so a shard can be slightly larger.
+        batch_size: rows read from a processed dataset and written at once.
+        max_examples, split, seed, cache_dir, streaming, quality, normalize: same as 'get_mixture'.
+        num_workers: the number of datasets processed and written at the same time.
+        executor: 'thread' or 'process'. pool type used when num_workers > 1.
+    Returns:
+        the manifest, {'datasets': {name: {'rows', 'shards': [{'path', 'rows', 'bytes', 'sha256'}]}}, ...}.
+        shards of a dataset are named '<name>-00000.parquet', ... in the order of its rows.
+        shards listed in the manifest of a previous export to 'output_dir' are replaced, and other files are kept.
+    """
+    available_dataset = list_datasets()
+    assert all(n in available_dataset for n in dataset_names), f"Invalid dataset name. available: {available_dataset}"
+    assert file_format in ('parquet', 'jsonl'), "file_format must be 'parquet' or 'jsonl'."
+    assert file_format == 'parquet' or compression in JSONL_EXTENSIONS, \
+        f"jsonl compression must be one of {list(JSONL_EXTENSIONS)}."
+    assert executor in ('thread', 'process'), "executor must be 'thread' or 'process'."
+
+    output_dir = Path(output_dir).expanduser()
+    output_dir.mkdir(parents=True, exist_ok=True)
+    tmp_dir = output_dir / f".tmp-{uuid.uuid4().hex}"
+    tmp_dir.mkdir()
+    cache = DatasetCache(cache_dir) if cache_dir else None
+    quality = _quality_filters(dataset_names, quality)
+    normalizations = _normalizations(dataset_names, normalize)
+    args = [(
+        name, str(tmp_dir), file_format, compression, max_shard_bytes, batch_size,
+        max_examples, split, seed, cache, streaming, quality.get(name), normalizations[name],
+    ) for name in dataset_names]
+    try:
+        if num_workers > 1 and len(dataset_names) > 1:
+            pool_cls = ThreadPoolExecutor if executor == 'thread' else ProcessPoolExecutor
+            with pool_cls(max_workers=min(num_workers, len(dataset_names))) as pool:
+                exported = list(pool.map(_export_dataset, *zip(*args)))
+        else:
+            exported = [_export_dataset(*arg) for arg in args]
+    except BaseException:
+        shutil.rmtree(tmp_dir)
+        raise
+
+    manifest = {
+        'format': file_format,
+        'compression': compression,
+        'split': split,
+        'max_examples': max_examples,
+        'seed': seed,
+        'rows': sum(e['rows'] for e in exported),
+        'datasets': dict(zip(dataset_names, exported)),
+    }
+    previous = _shard_paths(output_dir)
+    with open(tmp_dir / MANIFEST_FILE, 'wt', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    current = _shard_paths(tmp_dir)
+    for path in current:
+        os.replace(tmp_dir / path, output_dir / path)
+    os.replace(tmp_dir / MANIFEST_FILE, output_dir / MANIFEST_FILE)
+    tmp_dir.rmdir()
+    for path in previous - current:  # shards of a previous export, like those of datasets dropped since
+        (output_dir / path).unlink(missing_ok=True)
+    return manifest
+
+
+def _shard_paths(output_dir: Path):
+    """shard paths listed in the manifest of 'output_dir', or an empty set if there is no export."""
+    if not (output_dir / MANIFEST_FILE).exists():
+        return set()
+    with open(output_dir / MANIFEST_FILE, 'rt', encoding='utf-8') as f:
+        manifest = json.load(f)
+    return {shard['path'] for exported in manifest['datasets'].values() for shard in exported['shards']}
+
+
+def verify_export(output_dir: str) -> List[str]:
+    """paths of shards in 'output_dir' which are missing or whose sha256 differs from the manifest."""
+    output_dir = Path(output_dir).expanduser()
+    with open(output_dir / MANIFEST_FILE, 'rt', encoding='utf-8') as f:
+        manifest = json.load(f)
+    return [
+        shard['path'] for exported in manifest['datasets'].values() for shard in exported['shards']
+        if not (output_dir / shard['path']).exists() or _sha256(output_dir / shard['path']) != shard['sha256']
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="export processed pklue datasets to sharded files")
+    parser.add_argument('datasets', nargs='+')
+    parser.add_argument('--output-dir', required=True)
+    parser.add_argument('--format', choices=['parquet', 'jsonl'], default='parquet')
+    parser.add_argument('--compression', default='zstd', help="codec, or 'none'.")
+    parser.add_argument('--max-shard-mb', type=int, default=256)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--max-examples', type=int, default=None)
+    parser.add_argument('--split', default='train')
+    parser.add_argument('--num-workers', type=int, default=1)
+    parser.add_argument('--executor', choices=['thread', 'process'], default='process')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--cache-dir', default=None)
+    parser.add_argument('--streaming', action='store_true')
+    parser.add_argument('--verify', action='store_true', help="check shard checksums after writing.")
+    args = parser.parse_args(argv)
+
+    manifest = export_mixture(
+        args.datasets, args.output_dir, file_format=args.format,
+        compression=None if args.compression == 'none' else args.compression,
+        max_shard_bytes=args.max_shard_mb * 2 ** 20, batch_size=args.batch_size, max_examples=args.max_examples,
+        split=args.split, num_workers=args.num_workers, executor=args.executor, seed=args.seed,
+        cache_dir=args.cache_dir, streaming=args.streaming,
+    )
+    for name, exported in manifest['datasets'].items():
+        print(f"{name:<32}{exported['rows']:>10} rows{len(exported['shards']):>6} shards")
+    if args.verify:
+        corrupted = verify_export(args.output_dir)
+        for path in corrupted:
+            print(f"CHECKSUM MISMATCH {path}")
+        return 1 if corrupted else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,173 @@
+# Copyright 2023 NLP & AI Lab - Korea University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""per-stage instrumentation of the mixture pipeline
+
+Pipeline code wraps each stage with 'stage()'. Unless a callback is installed with 'recording()'
+in the current thread, 'stage()' returns a shared no-op object, so instrumentation costs nothing.
+"""
+
+from contextlib import contextmanager
+from typing import Callable, NamedTuple, Optional
+import sys
+import threading
+import time
+
+_local = threading.local()
+
+
+class StageEvent(NamedTuple):
+    dataset: Optional[str]
+    stage: str
+    seconds: float
+    rows: Optional[int] = None
+    num_bytes: Optional[int] = None
+    cache_hit: Optional[bool] = None
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set_result(self, ds, cache_hit=None):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, callback, name):
+        self.callback = callback
+        self.name = name
+        self.rows = self.num_bytes = self.cache_hit = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        self.callback(StageEvent(
+            getattr(_local, 'dataset', None), self.name, seconds, self.rows, self.num_bytes, self.cache_hit
+        ))
+        return False
+
+    def set_result(self, ds, cache_hit=None):
+        """record row count and arrow bytes of the stage output, a dataset or a list of datasets.
+        unknown for IterableDataset. the bytes of a 'select()' view are those of its share of the table's rows."""
+        self.cache_hit = cache_hit
+        datasets = ds if isinstance(ds, list) else [ds]
+        if all(hasattr(getattr(d, 'data', None), 'nbytes') for d in datasets):
+            self.rows = sum(len(d) for d in datasets)
+            self.num_bytes = sum(_view_nbytes(d) for d in datasets)
+
+
+def _view_nbytes(ds):
+    if ds._indices is None or not ds.data.num_rows:
+        return ds.data.nbytes
+    return int(ds.data.nbytes * len(ds) / ds.data.num_rows)
+
+
+def stage(name):
+    """context manager timing a pipeline stage. call 'set_result' on it to record the output size."""
+    callback = getattr(_local, 'callback', None)
+    if callback is None:
+        return _NULL_STAGE
+    return _Stage(callback, name)
+
+
+@contextmanager
+def recording(callback: Callable[[StageEvent], None], dataset: str = None):
+    """send events of stages run in this thread to 'callback'. does nothing if callback is None."""
+    previous = getattr(_local, 'callback', None), getattr(_local, 'dataset', None)
+    if callback is not None:
+        _local.callback, _local.dataset = callback, dataset
+    try:
+        yield
+    finally:
+        _local.callback, _local.dataset = previous
+
+
+@contextmanager
+def profiling(mode: str = None, path: str = None):
+    """profile the block with 'cprofile' or 'tracemalloc' and write a text report to 'path'.
+
+    cProfile records only the thread which enables it before python 3.12, so threads started in the block,
+    like the workers of executor='thread', get a profiler of their own and the report merges them all.
+    subprocesses are not profiled.
+    tracemalloc sees only python allocations, not arrow buffers, which hold most of the data of a build.
+    its report also has the bytes allocated by arrow's memory pool and the pool's peak, which covers
+    the whole process lifetime. memory-mapped arrow files are in neither.
+    """
+    if mode is None:
+        yield
+        return
+    assert mode in ('cprofile', 'tracemalloc'), "profile must be 'cprofile' or 'tracemalloc'."
+    assert path, "profile needs a report path."
+
+    if mode == 'cprofile':
+        import cProfile
+        import pstats
+
+        profilers = [cProfile.Profile()]
+        lock = threading.Lock()
+
+        def profile_thread(*_):
+            # first event of a new thread. the thread's profiler replaces this hook
+            thread_profiler = cProfile.Profile()
+            with lock:
+                profilers.append(thread_profiler)
+            thread_profiler.enable()
+
+        previous_hook = threading.getprofile()
+        if sys.version_info < (3, 12):  # since 3.12 one profiler sees every thread
+            threading.setprofile(profile_thread)
+        profilers[0].enable()
+        try:
+            yield
+        finally:
+            profilers[0].disable()
+            threading.setprofile(previous_hook)
+            with open(path, 'wt', encoding='utf-8') as f:
+                with lock:
+                    stats = pstats.Stats(*profilers, stream=f)
+                stats.sort_stats('cumulative').print_stats(50)
+        return
+
+    import tracemalloc
+
+    import pyarrow as pa
+
+    arrow_start = pa.total_allocated_bytes()
+    already_tracing = tracemalloc.is_tracing()
+    if not already_tracing:
+        tracemalloc.start()
+    try:
+        yield
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if not already_tracing:
+            tracemalloc.stop()
+        with open(path, 'wt', encoding='utf-8') as f:
+            f.write(f"python current: {current / 2 ** 20:.1f} MiB, peak: {peak / 2 ** 20:.1f} MiB\n")
+            f.write(f"arrow start: {arrow_start / 2 ** 20:.1f} MiB, "
+                    f"end: {pa.total_allocated_bytes() / 2 ** 20:.1f} MiB, "
+                    f"pool peak: {pa.default_memory_pool().max_memory() / 2 ** 20:.1f} MiB\n")
+            for stat in snapshot.statistics('lineno')[:50]:
+                f.write(f"{stat}\n")
@@ -3,6 +3,12 @@
 reference: https://sari-kun.tistory.com/10
 """
 
+from typing import List, Union
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
 # 초성 리스트. 00 ~ 18
 CHOSUNG_LIST = ['ㄱ', 'ㄲ', 'ㄴ', 'ㄷ', 'ㄸ', 'ㄹ', 'ㅁ', 'ㅂ', 'ㅃ', 'ㅅ', 'ㅆ', 'ㅇ', 'ㅈ', 'ㅉ', 'ㅊ', 'ㅋ', 'ㅌ', 'ㅍ',
                 'ㅎ']
@@ -19,27 +25,78 @@ ENG_LIST = ['에이','비','씨','디','이','에프','지','에이치','아이'
             '유','브이','더블유','엑스','와이','제트']
 
 
+HANGUL_BASE = ord('가')
+HANGUL_COUNT = 11172
+JONGSUNG_RIEUL = JONGSUNG_LIST.index('ㄹ')
+
+# 조사 이름: (받침이 있을 때, 받침이 없을 때)
+PARTICLES = {
+    '은/는': ('은', '는'),
+    '이/가': ('이', '가'),
+    '을/를': ('을', '를'),
+    '와/과': ('과', '와'),
+    '(으)로': ('으로', '로'),
+}
+
+
+def _build_jongsung_table():
+    """종성 index of every code point up to the end of the Hangul block. -1 for characters without reading.
+    digits and latin letters have the 종성 of their Korean reading."""
+    table = np.full(HANGUL_BASE + HANGUL_COUNT, -1, dtype=np.int8)
+    table[HANGUL_BASE:] = np.arange(HANGUL_COUNT) % 28
+    readings = [(str(i), NUMBER_LIST[i]) for i in range(10)]
+    readings += [(chr(ord('a') + i), r) for i, r in enumerate(ENG_LIST)]
+    readings += [(chr(ord('A') + i), r) for i, r in enumerate(ENG_LIST)]
+    for char, reading in readings:
+        table[ord(char)] = table[ord(reading[-1])]
+    return table
+
+
+JONGSUNG_TABLE = _build_jongsung_table()
+
+
+def last_jongsung(words: Union[pa.Array, pa.ChunkedArray, np.ndarray, List[str]]) -> np.ndarray:
+    """종성 index of the last character of every word, ignoring trailing whitespace.
+    0 if it has no 받침, -1 if it is unknown, like empty words or punctuation."""
+    if isinstance(words, pa.ChunkedArray):
+        words = words.combine_chunks()
+    elif not isinstance(words, pa.Array):
+        words = pa.array(np.asarray(words, dtype=object), type=pa.string())
+    last = pc.utf8_slice_codeunits(pc.utf8_rtrim_whitespace(pc.fill_null(words, '')), -1)
+    # one placeholder per empty word, so the joined string has exactly one character per word
+    last = pc.if_else(pc.equal(pc.utf8_length(last), 0), '\x00', last)
+    joined = pc.binary_join(pa.ListArray.from_arrays(pa.array([0, len(last)], type=pa.int32()), last), '')[0].as_py()
+    codepoints = np.frombuffer(joined.encode('utf-32-le'), dtype=np.uint32)
+    known = codepoints < len(JONGSUNG_TABLE)
+    return np.where(known, JONGSUNG_TABLE[np.where(known, codepoints, 0)], -1).astype(np.int8)
+
+
+def particle(words, name: str) -> pa.StringArray:
+    """the form of particle 'name' (a key of PARTICLES) which follows every word.
+
+    (으)로 takes '로' after ㄹ 받침. words with unknown 받침 take the form without 받침.
+    """
+    if name not in PARTICLES:
+        raise ValueError(f"unknown particle '{name}'. available: {list(PARTICLES)}")
+    jongsung = last_jongsung(words)
+    has_final = jongsung > 0
+    if name == '(으)로':
+        has_final &= jongsung != JONGSUNG_RIEUL
+    with_final, without_final = PARTICLES[name]
+    return pc.take(pa.array([without_final, with_final]), pa.array(has_final.astype(np.int8)))
+
+
+def attach_particle(words, name: str) -> pa.StringArray:
+    """every word followed by the form of particle 'name'."""
+    words = pa.array(words, type=pa.string()) if isinstance(words, (list, np.ndarray)) else words
+    return pc.binary_join_element_wise(pc.fill_null(words, ''), particle(words, name), '')
+
+
+def josa(korean_word, name: str):
+    """조사 판단 함수. the form of particle 'name' following one word."""
+    return particle([korean_word], name)[0].as_py()
+
+
 def bojosa(korean_word):
     """은/는 조사 판단 함수"""
-    if korean_word is not None and len(korean_word) > 0:
-        w = korean_word[len(korean_word) - 1]  # 마지막 글자 획득
-        ## 영어인 경우 구분해서 작성함.
-        if '가' <= w <= '힣':
-            ## 588개 마다 초성이 바뀜.
-            ch1 = (ord(w) - ord('가')) // 588
-            ## 중성은 총 28가지 종류
-            ch2 = ((ord(w) - ord('가')) - (588 * ch1)) // 28
-            ch3 = (ord(w) - ord('가')) - (588 * ch1) - 28 * ch2
-            if ch3 == 0:
-                return '는'
-            else:
-                return '은'
-        elif '0' <= w <= '9':  # 숫자일 경우
-            return bojosa(NUMBER_LIST[ord(w) - ord('0')])
-        elif type(w) is int and 0 <= w <= 9:
-            return bojosa(NUMBER_LIST[w])
-        elif 'a' <= w <= 'z':  # 영문일 경우
-            return bojosa(ENG_LIST[ord(w) - ord('a')])
-        elif 'A' <= w <= 'Z':
-            return bojosa(ENG_LIST[ord(w) - ord('A')])
-    return '는'  # 디폴트로 '는' 리턴
\ No newline at end of file
+    return josa(korean_word, '은/는')
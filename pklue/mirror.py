@@ -0,0 +1,135 @@
+# Copyright 2023 NLP & AI Lab - Korea University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""offline mirror of the huggingface sources of pklue
+
+'mirror_sources' snapshots every source listed in the dataset manifests to '<mirror>/<hf_id>/<subset>'
+as arrow files. Every processor loads its source through 'resolve_dataset', which reads the mirror
+with memory-mapping and no hub calls once a mirror is set by 'use_mirror' or the PKLUE_MIRROR
+environment variable, and falls back to 'datasets.load_dataset' otherwise.
+
+Usage:
+    python -m pklue.mirror /data/pklue-mirror            # on a machine with network
+    PKLUE_MIRROR=/data/pklue-mirror python train.py     # on training nodes
+"""
+
+from pathlib import Path
+from typing import Dict, List, Tuple
+import argparse
+import json
+import os
+import sys
+
+import datasets
+
+from .registry import get_info, list_datasets
+
+MIRROR_ENV = 'PKLUE_MIRROR'
+MIRROR_MANIFEST = 'mirror.json'
+
+
+def use_mirror(mirror_dir):
+    """serve every source from 'mirror_dir', also in worker processes started afterwards. None to disable."""
+    if mirror_dir is None:
+        os.environ.pop(MIRROR_ENV, None)
+    else:
+        os.environ[MIRROR_ENV] = str(Path(mirror_dir).expanduser())
+
+
+def source_path(mirror_dir, hf_id, subset=None) -> Path:
+    return Path(mirror_dir) / hf_id.replace('/', '__') / (subset or 'default')
+
+
+def resolve_dataset(hf_id, subset: str = None, split: str = None, streaming=False):
+    """'datasets.load_dataset(hf_id, subset, split=split, streaming=streaming)', served from the mirror if it is set.
+
+    A mirrored source is a memory-mapped DatasetDict, and a missing source raises FileNotFoundError
+    instead of reaching the hub. Streaming turns the mirrored splits into IterableDataset.
+    """
+    mirror_dir = os.environ.get(MIRROR_ENV)
+    if not mirror_dir:
+        if subset:
+            return datasets.load_dataset(hf_id, subset, split=split, streaming=streaming)
+        return datasets.load_dataset(hf_id, split=split, streaming=streaming)
+
+    path = source_path(mirror_dir, hf_id, subset)
+    if not path.exists():
+        raise FileNotFoundError(f"'{hf_id}' ({subset or 'default'}) is not in the mirror {mirror_dir}. "
+                                f"run 'python -m pklue.mirror {mirror_dir}' where the hub is reachable.")
+    ds_dict = datasets.load_from_disk(str(path))
+    if streaming:
+        ds_dict = datasets.IterableDatasetDict({k: v.to_iterable_dataset() for k, v in ds_dict.items()})
+    if split is None:
+        return ds_dict
+    if split not in ds_dict:
+        raise ValueError(f"'{hf_id}' ({subset or 'default'}) has no split '{split}'. available: {list(ds_dict)}")
+    return ds_dict[split]
+
+
+def source_fingerprint(hf_id, subset=None):
+    """fingerprint of the mirrored arrow files of a source, which changes when the mirror is refreshed.
+    None if no mirror is set or the source is not mirrored, since hub revisions are not tracked."""
+    mirror_dir = os.environ.get(MIRROR_ENV)
+    if not mirror_dir:
+        return None
+    path = source_path(mirror_dir, hf_id, subset)
+    states = sorted(path.glob("*/state.json"))
+    if not states:
+        return None
+    return {state.parent.name: json.loads(state.read_text(encoding='utf-8'))['_fingerprint'] for state in states}
+
+
+def sources(dataset_names: List[str] = None) -> List[Tuple[str, str]]:
+    """(hf_id, subset) of every source used by 'dataset_names', or by every dataset."""
+    infos = [get_info(name) for name in (dataset_names or list_datasets())]
+    return sorted({(info.hf_id, info.subset) for info in infos if info.hf_id}, key=lambda s: (s[0], s[1] or ''))
+
+
+def mirror_sources(mirror_dir, dataset_names: List[str] = None, overwrite=False) -> Dict:
+    """download every source of 'dataset_names' into 'mirror_dir' and write 'mirror.json'.
+
+    Sources which are already mirrored are skipped unless 'overwrite'. Returns the mirror manifest,
+    {'<hf_id>/<subset>': {split: num_rows}}.
+    """
+    mirror_dir = Path(mirror_dir).expanduser()
+    manifest_path = mirror_dir / MIRROR_MANIFEST
+    manifest = json.loads(manifest_path.read_text(encoding='utf-8')) if manifest_path.exists() else {}
+    for hf_id, subset in sources(dataset_names):
+        key = f"{hf_id}/{subset or 'default'}"
+        path = source_path(mirror_dir, hf_id, subset)
+        if path.exists() and key in manifest and not overwrite:
+            continue
+        ds_dict = datasets.load_dataset(hf_id, subset) if subset else datasets.load_dataset(hf_id)
+        ds_dict.save_to_disk(str(path))
+        manifest[key] = {split: len(ds) for split, ds in ds_dict.items()}
+        mirror_dir.mkdir(parents=True, exist_ok=True)
+        manifest_path.write_text(json.dumps(manifest, indent=2), encoding='utf-8')  # after every source
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="snapshot the huggingface sources of pklue datasets")
+    parser.add_argument('mirror_dir')
+    parser.add_argument('--datasets', nargs='*', help="datasets whose sources are mirrored. defaults to every dataset.")
+    parser.add_argument('--overwrite', action='store_true', help="download sources which are already mirrored.")
+    args = parser.parse_args(argv)
+
+    manifest = mirror_sources(args.mirror_dir, args.datasets, overwrite=args.overwrite)
+    for key, splits in manifest.items():
+        print(f"{key:<48}{json.dumps(splits)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+# Copyright 2023 NLP & AI Lab - Korea University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""weighted and temperature-sampled interleaving of processed datasets"""
+
+from typing import List, Union
+
+import numpy as np
+from datasets import Dataset, IterableDataset, concatenate_datasets, interleave_datasets
+
+
+def mixture_probabilities(sizes, weights=None, temperature=None):
+    """sampling probability of each dataset.
+
+    Args:
+        sizes: the number of examples of each dataset.
+        weights: relative weight of each dataset. normalized to sum to 1.
+        temperature: if weights are not given, p_i is proportional to sizes_i ** (1 / temperature).
+            1 keeps the natural proportion, and larger values flatten it toward uniform.
+    """
+    if weights is not None:
+        assert len(weights) == len(sizes), "weights must have one value per dataset."
+        p = np.asarray(weights, dtype=np.float64)
+    else:
+        assert temperature is not None and temperature > 0, "either weights or positive temperature is needed."
+        p = np.asarray(sizes, dtype=np.float64) ** (1.0 / temperature)
+    assert (p >= 0).all() and p.sum() > 0, "weights must be non-negative and not all zero."
+    return p / p.sum()
+
+
+def interleave_indices(sizes, probabilities, num_examples, rng: np.random.Generator):
+    """indices into the concatenation of datasets of 'sizes', drawn dataset-by-dataset with 'probabilities'.
+
+    Rows of each dataset are taken in a random order of its own, a new permutation for every pass over it,
+    so a down-weighted dataset contributes a random sample rather than its first rows, and an up-weighted one
+    repeats every row before any row is repeated twice.
+    Only integers are handled here, so the cost is O(1) per example regardless of row size.
+    """
+    sizes = np.asarray(sizes, dtype=np.int64)
+    probabilities = np.where(sizes > 0, probabilities, 0)
+    probabilities = probabilities / probabilities.sum()
+    source = rng.choice(len(sizes), size=num_examples, p=probabilities)
+    # one generator per dataset, so the rows of a dataset do not depend on how often the others are drawn
+    dataset_rngs = [np.random.default_rng(s) for s in rng.integers(2 ** 63, size=len(sizes))]
+
+    offsets = np.cumsum(sizes) - sizes
+    indices = np.empty(num_examples, dtype=np.int64)
+    for i, (size, dataset_rng) in enumerate(zip(sizes.tolist(), dataset_rngs)):
+        draws = np.flatnonzero(source == i)
+        if not len(draws):
+            continue
+        passes = -(-len(draws) // size)
+        rows = np.concatenate([dataset_rng.permutation(size) for _ in range(passes)])[:len(draws)]
+        indices[draws] = offsets[i] + rows
+    return indices
+
+
+def interleave(
+        datasets: List[Union[Dataset, IterableDataset]],
+        weights: List[float] = None,
+        temperature: float = None,
+        num_examples: int = None,
+        seed: int = None,
+        sizes: List[int] = None,
+) -> Union[Dataset, IterableDataset]:
+    """Interleave datasets by sampling each example's source dataset.
+
+    Args:
+        datasets: processed datasets with the same columns.
+        weights: relative weight of each dataset.
+        temperature: used when weights are not given. see 'mixture_probabilities'.
+        num_examples: length of the mixture. defaults to the sum of the dataset sizes.
+        seed: seed of the sampler.
+        sizes: sizes of IterableDataset, whose length is unknown. used for temperature sampling and
+            as the default num_examples, so a streamed mixture has the same length as a Dataset one.
+    Returns:
+        Dataset which is a 'select()' view over the concatenated datasets, so no row is copied.
+        IterableDataset if 'datasets' are iterable.
+    """
+    if all(isinstance(ds, IterableDataset) for ds in datasets):
+        assert sizes is not None, "interleaving IterableDataset needs 'sizes'."
+        probabilities = mixture_probabilities(sizes, weights, temperature)
+        # a dataset which is never drawn would never be exhausted, and the mixture would never end
+        assert (probabilities > 0).all(), "weights of IterableDataset must be positive."
+        if num_examples is None:
+            num_examples = sum(sizes)
+        return interleave_datasets(
+            datasets, probabilities=probabilities.tolist(), seed=seed, stopping_strategy='all_exhausted'
+        ).take(num_examples)
+
+    sizes = [len(ds) for ds in datasets]
+    probabilities = mixture_probabilities(sizes, weights, temperature)
+    if num_examples is None:
+        num_examples = sum(sizes)
+    indices = interleave_indices(sizes, probabilities, num_examples, np.random.default_rng(seed))
+    return concatenate_datasets(datasets).select(indices)
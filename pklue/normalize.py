@@ -0,0 +1,144 @@
+# Copyright 2023 NLP & AI Lab - Korea University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""unicode normalization of source text
+
+Every string of a loaded source, including strings nested in lists and structs, is normalized once
+with arrow string kernels: NFC composition of decomposed Hangul, odd spaces like U+00A0 and U+3000
+replaced by ' ', and zero-width and control characters removed. Processors therefore render templates
+and pick particles from clean text. 'get_mixture' sets the normalization of every dataset with 'normalizing'.
+"""
+
+from contextlib import contextmanager
+from typing import NamedTuple, Optional, Union
+import threading
+
+import pyarrow as pa
+import pyarrow.compute as pc
+from datasets import Dataset, IterableDataset
+
+from .instrument import stage
+
+# space separators other than ' ', like U+00A0, U+2002..U+200A and U+3000
+_SPACES = r'[^\P{Zs} ]'
+# control characters other than '\t' and '\n', and format characters like U+200B, U+FEFF and U+00AD
+_CONTROLS = r'[\x00-\x08\x0b-\x1f\x7f-\x9f\p{Cf}]'
+
+
+class TextNormalization(NamedTuple):
+    form: Optional[str] = 'NFC'  # unicode normalization form, or None
+    spaces: bool = True  # replace odd space separators by ' '
+    controls: bool = True  # turn '\r\n' into '\n' and remove other control and zero-width characters
+    strip: bool = True  # remove leading and trailing whitespace
+    num_proc: Optional[int] = None  # processes of the normalizing 'Dataset.map'
+
+
+_local = threading.local()
+_UNSET = object()
+
+
+@contextmanager
+def normalizing(config: Optional[TextNormalization]):
+    """normalize sources loaded in this thread with 'config', or not at all if it is None."""
+    previous = getattr(_local, 'config', _UNSET)
+    _local.config = config
+    try:
+        yield
+    finally:
+        _local.config = previous
+
+
+def current_normalization() -> Optional[TextNormalization]:
+    """normalization set by 'normalizing', or the default TextNormalization() outside of it."""
+    config = getattr(_local, 'config', _UNSET)
+    return TextNormalization() if config is _UNSET else config
+
+
+def normalize_strings(array: pa.Array, config: TextNormalization = TextNormalization()) -> pa.Array:
+    """normalize a string array."""
+    if config.controls:
+        array = pc.replace_substring(array, '\r\n', '\n')
+        array = pc.replace_substring_regex(array, _CONTROLS, '')
+    if config.spaces:
+        array = pc.replace_substring_regex(array, _SPACES, ' ')
+    if config.form:
+        array = pc.utf8_normalize(array, config.form)
+    if config.strip:
+        array = pc.utf8_trim_whitespace(array)
+    return array
+
+
+def normalize_array(array: Union[pa.Array, pa.ChunkedArray], config: TextNormalization = TextNormalization()):
+    """normalize every string of 'array', recursing into lists and structs. other values are kept."""
+    if isinstance(array, pa.ChunkedArray):
+        return pa.chunked_array([normalize_array(chunk, config) for chunk in array.chunks], type=array.type)
+    if pa.types.is_string(array.type) or pa.types.is_large_string(array.type):
+        return normalize_strings(array, config)
+    if pa.types.is_list(array.type) or pa.types.is_large_list(array.type):
+        # only the values of this slice of the list array, which can share a much longer values array
+        offsets = array.offsets
+        start, end = offsets[0].as_py(), offsets[-1].as_py()
+        values = normalize_array(array.values.slice(start, end - start), config)
+        mask = array.is_null() if array.null_count else None
+        return type(array).from_arrays(pc.subtract(offsets, start), values, type=array.type, mask=mask)
+    if pa.types.is_struct(array.type):
+        children = [normalize_array(array.field(i), config) for i in range(array.type.num_fields)]
+        mask = array.is_null() if array.null_count else None
+        return pa.StructArray.from_arrays(children, fields=list(array.type), mask=mask)
+    return array
+
+
+def _has_strings(data_type: pa.DataType) -> bool:
+    if pa.types.is_string(data_type) or pa.types.is_large_string(data_type):
+        return True
+    if pa.types.is_list(data_type) or pa.types.is_large_list(data_type):
+        return _has_strings(data_type.value_type)
+    if pa.types.is_struct(data_type):
+        return any(_has_strings(field.type) for field in data_type)
+    return False
+
+
+def _normalize_batch(batch: pa.Table, columns, config):
+    return pa.table({c: normalize_array(batch.column(c), config) if c in columns else batch.column(c)
+                     for c in batch.column_names})
+
+
+def normalize_text(data: Union[Dataset, IterableDataset], config=_UNSET, batch_size=1000):
+    """Normalize every string column of 'data', see 'TextNormalization'.
+
+    config defaults to the normalization of the current dataset set by 'normalizing'. None returns 'data' as is.
+    A Dataset is normalized with one batched arrow 'map', in config.num_proc processes.
+    IterableDataset is normalized lazily while iterating.
+    """
+    config = current_normalization() if config is _UNSET else config
+    features = data.features
+    columns = [f.name for f in features.arrow_schema if _has_strings(f.type)] if features is not None else None
+    if config is None or columns == []:
+        return data
+
+    if isinstance(data, IterableDataset):
+        return data.with_format('arrow').map(
+            lambda batch: _normalize_batch(
+                batch, columns or [c for c in batch.column_names if _has_strings(batch.column(c).type)], config
+            ),
+            batched=True, batch_size=batch_size, features=features,
+        ).with_format()
+
+    with stage('normalize') as s:
+        new_data = data.with_format('arrow').map(
+            _normalize_batch, fn_kwargs={'columns': columns, 'config': config},
+            batched=True, batch_size=batch_size, features=features, num_proc=config.num_proc,
+        ).with_format()
+        s.set_result(new_data)
+    return new_data
@@ -0,0 +1,190 @@
+# Copyright 2023 NLP & AI Lab - Korea University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""token-length-aware packing and bucketing of get_mixture output
+
+Example:
+    >>> ds = add_lengths(get_mixture(['kullm_v2']), lambda texts: tokenizer(texts)['input_ids'], num_proc=8)
+    >>> packed, stats = pack(ds, max_length=8192)
+    >>> stats.efficiency
+"""
+
+from typing import Callable, List, NamedTuple
+
+import numpy as np
+import pyarrow as pa
+from datasets import Dataset
+
+from .chat import chat_arrays, chat_column
+
+Tokenize = Callable[[List[str]], List[List[int]]]
+
+
+class PackingStats(NamedTuple):
+    num_sequences: int
+    num_packs: int
+    num_tokens: int
+    max_length: int
+    # rows longer than max_length, which are put in a pack of their own
+    num_overflow: int
+
+    @property
+    def efficiency(self):
+        """ratio of real tokens in the packed sequences."""
+        return self.num_tokens / max(self.num_packs * self.max_length, 1)
+
+    @property
+    def unpacked_efficiency(self):
+        """ratio of real tokens when every sequence is padded to max_length."""
+        return self.num_tokens / max(self.num_sequences * self.max_length, 1)
+
+
+def _chat_lengths(batch: pa.Table, tokenize: Tokenize, turn_overhead: int):
+    arrays = chat_arrays(batch.column('chat'))
+    turn_lengths = np.fromiter((len(ids) for ids in tokenize(arrays.contents.to_pylist())), dtype=np.int64,
+                               count=len(arrays.contents))
+    turn_counts = np.diff(arrays.offsets)
+    row_of_turn = np.repeat(np.arange(len(turn_counts)), turn_counts)
+    lengths = np.bincount(row_of_turn, weights=turn_lengths, minlength=len(turn_counts)).astype(np.int64)
+    return pa.table({'length': lengths + turn_overhead * turn_counts})
+
+
+def add_lengths(ds: Dataset, tokenize: Tokenize, turn_overhead: int = 0, num_proc: int = None, batch_size=1000):
+    """Add 'length' column, the number of tokens of each chat.
+
+    Args:
+        ds: dataset with 'chat' column.
+        tokenize: callable which maps a batch of texts to a batch of token ids.
+            e.g. lambda texts: tokenizer(texts, add_special_tokens=False)['input_ids']
+        turn_overhead: tokens added per turn by the chat template, like role headers and eos.
+        num_proc: the number of tokenizing processes.
+        batch_size: rows tokenized at once.
+    """
+    lengths = ds.select_columns(['chat']).with_format('arrow').map(
+        _chat_lengths, fn_kwargs={'tokenize': tokenize, 'turn_overhead': turn_overhead},
+        batched=True, batch_size=batch_size, remove_columns=['chat'], num_proc=num_proc,
+    ).data.column('length')
+    if 'length' in ds.column_names:
+        ds = ds.remove_columns('length')
+    return ds.add_column('length', lengths.combine_chunks())
+
+
+def _lengths(ds: Dataset):
+    return ds.select_columns(['length']).with_format('numpy')[:]['length']
+
+
+class _FreeSpace:
+    """bins grouped by free space, with a segment tree to find the fullest bin that still fits."""
+
+    def __init__(self, max_length):
+        self.size = 1
+        while self.size < max_length + 1:
+            self.size *= 2
+        self.count = [0] * (2 * self.size)
+        self.bins = [[] for _ in range(max_length + 1)]
+
+    def _update(self, space, delta):
+        i = space + self.size
+        while i:
+            self.count[i] += delta
+            i //= 2
+
+    def push(self, space, bin_id):
+        self.bins[space].append(bin_id)
+        self._update(space, 1)
+
+    def pop_fit(self, length):
+        """pop the bin with the least free space >= length, or None."""
+        if length >= self.size:
+            return None
+        # walk up from the leaf of 'length' to find a subtree to the right which has a bin
+        i = length + self.size
+        if not self.count[i]:
+            while i > 1 and (i % 2 == 1 or not self.count[i + 1]):
+                i //= 2
+            if i <= 1:
+                return None
+            i += 1
+            while i < self.size:
+                i = 2 * i if self.count[2 * i] else 2 * i + 1
+        space = i - self.size
+        self._update(space, -1)
+        return space, self.bins[space].pop()
+
+
+def pack_indices(lengths, max_length):
+    """Best-fit-decreasing bin packing. Returns (row order, pack offsets) so that pack i is
+    order[offsets[i]:offsets[i + 1]]."""
+    order = np.argsort(-np.asarray(lengths), kind='stable')
+    free_space = _FreeSpace(max_length)
+    packs = []
+    for row in order.tolist():
+        length = int(lengths[row])
+        fit = free_space.pop_fit(length)
+        if fit is None:
+            packs.append([row])
+            space = max_length - length
+        else:
+            space, pack_id = fit
+            packs[pack_id].append(row)
+            space -= length
+        if space > 0:
+            free_space.push(space, len(packs) - 1 if fit is None else pack_id)
+    offsets = np.cumsum([0] + [len(p) for p in packs])
+    return np.fromiter((row for p in packs for row in p), dtype=np.int64, count=len(order)), offsets
+
+
+def pack(ds: Dataset, max_length: int):
+    """Pack chats of a dataset made by 'add_lengths' into sequences of at most max_length tokens.
+
+    Returns:
+        (packed dataset, PackingStats). packed dataset has 'chats' column which is the list of packed chats,
+        and 'length' column which is the sum of their lengths.
+    """
+    lengths = _lengths(ds)
+    order, offsets = pack_indices(lengths, max_length)
+    chats = chat_column(ds, order).combine_chunks()
+    pack_offsets = pa.array(offsets, type=pa.int32())
+    packed = Dataset(pa.table({
+        'chats': pa.ListArray.from_arrays(pack_offsets, chats),
+        'length': np.add.reduceat(lengths[order], offsets[:-1]) if len(order) else np.zeros(0, dtype=np.int64),
+    }))
+    stats = PackingStats(
+        num_sequences=len(lengths), num_packs=len(offsets) - 1, num_tokens=int(lengths.sum()),
+        max_length=max_length, num_overflow=int((lengths > max_length).sum()),
+    )
+    return packed, stats
+
+
+def bucket_by_length(ds: Dataset, boundaries: List[int], batch_size: int, seed: int = None):
+    """Reorder a dataset made by 'add_lengths' so that every 'batch_size' consecutive rows share a length bucket.
+
+    Rows are shuffled inside each bucket and batches are shuffled across buckets,
+    so a sequential sampler pads each batch only to its bucket's longest row.
+
+    Returns:
+        (reordered dataset with 'bucket' column, padding efficiency of the reordered batches)
+    """
+    rng = np.random.default_rng(seed)
+    lengths = _lengths(ds)
+    buckets = np.searchsorted(np.asarray(boundaries), lengths, side='left')
+    batches = []
+    for bucket in np.unique(buckets):
+        rows = rng.permutation(np.flatnonzero(buckets == bucket))
+        batches.extend(np.array_split(rows, range(batch_size, len(rows), batch_size)))
+    batches = [batches[i] for i in rng.permutation(len(batches))]
+    order = np.concatenate(batches) if batches else np.zeros(0, dtype=np.int64)
+    padded = sum(len(b) * lengths[b].max() for b in batches)
+    efficiency = lengths.sum() / max(padded, 1)
+    return ds.add_column('bucket', buckets).select(order), float(efficiency)
@@ -12,40 +12,274 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import List
-from pathlib import Path
-import importlib
-
+from typing import Callable, Dict, List, Optional, Union
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import datasets
 from datasets import concatenate_datasets
 
+from .cache import BuildDirectory, DatasetCache, cache_key
+from .chat import CHAT_FEATURES
+from .dedup import deduplicate, deduplicate_datasets
+from .instrument import StageEvent, profiling, recording, stage
+from .mixing import interleave
+from .normalize import TextNormalization, normalizing
+from .quality import QualityFilter, process_filtered
+from .registry import get_info, list_datasets, load_processor
+from .rng import seeded
+
+
+def _process_dataset(dataset_name, max_examples, split, seed, cache=None, streaming=False, quality=None,
+                     normalization=TextNormalization()):
+    if cache is not None and seed is not None and not streaming:
+        key = cache_key(dataset_name, split, max_examples, seed, quality, normalization)
+        with stage('cache_load') as s:
+            ds = cache.load(dataset_name, key)
+            s.set_result(ds, cache_hit=ds is not None)
+        if ds is None:
+            ds = _process_dataset(
+                dataset_name, max_examples, split, seed, quality=quality, normalization=normalization
+            )
+            with stage('cache_save') as s:
+                ds = cache.save(dataset_name, key, ds)
+                s.set_result(ds)
+        return ds
+
+    def process(num_rows):
+        with stage('process') as s:
+            ds = load_processor(dataset_name).process(num_rows, split, streaming=streaming)
+            s.set_result(ds)
+        return ds
+
+    with seeded(seed, dataset_name), normalizing(normalization):
+        if quality is None:
+            return process(max_examples)
+        # filtered on more source rows than max_examples, so that filtering does not shrink the dataset
+        return process_filtered(process, max_examples, quality, streaming=streaming)
+
+
+def _quality_filters(dataset_names, quality) -> dict:
+    """{dataset name: QualityFilter} from the 'quality' argument of 'get_mixture'."""
+    if quality is None:
+        return {}
+    if isinstance(quality, QualityFilter):
+        return {name: quality for name in dataset_names}
+    assert all(name in dataset_names for name in quality), "quality has a dataset which is not in dataset_names."
+    return dict(quality)
+
+
+def _normalizations(dataset_names, normalize) -> dict:
+    """{dataset name: TextNormalization or None} from the 'normalize' argument of 'get_mixture'."""
+    if normalize is None or isinstance(normalize, TextNormalization):
+        return {name: normalize for name in dataset_names}
+    assert all(name in dataset_names for name in normalize), "normalize has a dataset which is not in dataset_names."
+    return {name: normalize.get(name, TextNormalization()) for name in dataset_names}
+
+
+def _process_dataset_recorded(*args):
+    """run '_process_dataset' collecting its stage events, which are returned to the caller's thread or process."""
+    events = []
+    with recording(events.append, dataset=args[0]):
+        ds = _process_dataset(*args)
+    return ds, events
+
+
+def _known_size(dataset_name, ds, split, max_examples):
+    """size of a processed IterableDataset from its split info or manifest, or 'max_examples' if it is unknown."""
+    splits = ds.info.splits
+    if splits and split in splits and splits[split].num_examples:
+        return min(splits[split].num_examples, max_examples or float('inf'))
+    approx_size = get_info(dataset_name).approx_size
+    if approx_size:
+        return min(approx_size, max_examples or float('inf'))
+    assert max_examples, f"size of '{dataset_name}' is unknown. temperature sampling in streaming needs max_examples."
+    return max_examples
+
+
+def assign_datasets(dataset_names: List[str], world_size: int, max_examples: int = None) -> List[List[str]]:
+    """datasets built by every rank, balancing their approximate rows.
+
+    Largest datasets first, each to the rank with the fewest rows so far. datasets of unknown size count as
+    max_examples rows, or 1. the assignment depends only on the arguments, so every rank computes the same one.
+    """
+    def approx_rows(name):
+        approx_size = get_info(name).approx_size
+        if approx_size is None:
+            return max_examples or 1
+        return min(approx_size, max_examples or approx_size)
+
+    loads = [0] * world_size
+    ranks = {}
+    for name in sorted(dataset_names, key=approx_rows, reverse=True):
+        rank = loads.index(min(loads))
+        ranks[name] = rank
+        loads[rank] += approx_rows(name)
+    return [[name for name in dataset_names if ranks[name] == rank] for rank in range(world_size)]
+
 
 def get_mixture(
         dataset_names: List[str],
         max_examples: int = None,
         split: str = 'train',
-) -> datasets.Dataset:
+        num_workers: int = 1,
+        executor: str = 'thread',
+        seed: int = None,
+        cache_dir: str = None,
+        cache_max_bytes: int = None,
+        build_dir: str = None,
+        streaming: bool = False,
+        weights: List[float] = None,
+        temperature: float = None,
+        dedup: str = None,
+        quality: Union[QualityFilter, Dict[str, QualityFilter]] = None,
+        normalize: Union[TextNormalization, Dict[str, Optional[TextNormalization]]] = TextNormalization(),
+        on_event: Callable[[StageEvent], None] = None,
+        profile: str = None,
+        profile_path: str = None,
+        rank: int = None,
+        world_size: int = None,
+        gather: bool = True,
+        gather_timeout: float = None,
+) -> Union[datasets.Dataset, datasets.IterableDataset]:
     """Make mixed huggingface dataset with selected datasets.
 
     Args:
         dataset_names: list of dataset names. names are case-insensitive.
         max_examples: the number of maximum length of examples when do truncation.
         split: 'train' or 'test'
+        num_workers: the number of datasets processed at the same time. 1 means serial processing.
+        executor: 'thread' or 'process'. pool type used when num_workers > 1.
+        seed: if given, every dataset is processed with its own random stream derived from it (see pklue.rng),
+            so the result is the same for any num_workers and executor.
+        cache_dir: directory of the processed dataset cache. only seeded builds are cached.
+            editing a dataset's processor.py or template yaml invalidates only that dataset's entries.
+        cache_max_bytes: if given, least recently used cache entries are evicted above this size.
+        build_dir: directory of an incremental build, used instead of cache_dir. it keeps the latest shard of
+            every dataset and 'build.json', so a rebuild after adding a dataset or editing a template reprocesses
+            only the stale datasets and memory-maps the rest. needs seed.
+        streaming: if True, returns IterableDataset which loads, templates and converts examples lazily.
+            num_workers and cache are not used, since nothing is processed until iteration.
+        weights: if given, examples are interleaved, drawing each example's dataset with these relative weights.
+            the mixture has as many rows as the datasets together, also when streaming, where weights must be positive.
+        temperature: if given instead of weights, datasets are drawn in proportion to size ** (1 / temperature).
+            without weights or temperature, datasets are concatenated one after another.
+        dedup: 'exact' or 'near'. removes duplicated chats across all datasets, keeping the first occurrence.
+            'near' uses MinHash LSH and is not available in streaming mode.
+        quality: a 'pklue.quality.QualityFilter' applied to every dataset, or {dataset name: QualityFilter}
+            to filter only some datasets, like the machine-translated ones in pklue.quality.GENERATED_DATASETS.
+            chats with untranslated, empty, too long or repetitive turns are dropped from more source rows
+            than max_examples (see 'pklue.quality.process_filtered'), so a filtered dataset has max_examples rows
+            unless its source does not have enough rows which pass.
+        normalize: 'pklue.normalize.TextNormalization' of the source text of every dataset, applied once after
+            loading, or {dataset name: TextNormalization or None} to change it for some datasets. None disables it.
+        on_event: if given, called with a 'StageEvent' for every stage, like loading, subsampling, templating,
+            cache lookup and concatenation, with its dataset, seconds, rows, bytes and cache hit.
+            events of a dataset are delivered in the calling thread once the dataset is processed.
+            rows and bytes are None for streaming stages, whose size is unknown until iteration.
+        profile: 'cprofile' or 'tracemalloc'. profiles the build in the calling process and writes a report
+            to 'profile_path'. cprofile merges the profiles of the calling thread and of executor='thread' workers.
+            workers of executor='process' are not profiled.
+        rank, world_size: if given, a distributed build. datasets are split across the ranks by 'assign_datasets',
+            and every rank processes only its own into build_dir, which must be on a filesystem shared by the ranks.
+            needs build_dir and seed, so the shards are the same as those of a single build.
+        gather: if True, every rank waits for the shards of the other ranks and returns the same whole mixture,
+            and rank 0 writes 'build.json'. if False, returns the concatenation of the rank's own datasets,
+            which is empty for ranks without a dataset when world_size is larger than the number of datasets.
+        gather_timeout: seconds to wait for the other ranks before raising TimeoutError. None waits forever.
     Returns:
         Huggingface dataset which contains mixture of 'dataset_names'.
         Returned dataset's columns are like
-        {"chat": [['user', '...'], ['assistant', '...'], ...]}
+        {"chat": [{'role': 1, 'content': '...'}, {'role': 2, 'content': '...'}, ...]}
+        where role is an index of pklue.chat.ROLES. see pklue.chat for columnar accessors,
+        and 'to_tuples' for the [('user', '...'), ('assistant', '...')] form.
     """
-    available_dataset = [e.name for e in (Path(__file__).parent / "available_dataset/").glob("*/")]
+    available_dataset = list_datasets()
     assert isinstance(dataset_names, list), "dataset_names must be python list."
     assert all(n in available_dataset for n in dataset_names), f"Invalid dataset name. available: {available_dataset}"
+    assert executor in ('thread', 'process'), "executor must be 'thread' or 'process'."
+    assert dedup in (None, 'exact', 'near'), "dedup must be None, 'exact' or 'near'."
+    assert build_dir is None or cache_dir is None, "give either cache_dir or build_dir."
+    assert build_dir is None or seed is not None, "incremental builds need a seed."
+    if world_size is not None:
+        assert rank is not None and 0 <= rank < world_size, "rank must be in [0, world_size)."
+        assert build_dir is not None and not streaming, "distributed builds need build_dir and no streaming."
+        assert gather or (weights is None and temperature is None and dedup is None), \
+            "weights, temperature and dedup apply to the whole mixture, so they need gather."
+    with recording(on_event), profiling(profile, profile_path):
+        return _build_mixture(
+            dataset_names, max_examples, split, num_workers, executor, seed, cache_dir, cache_max_bytes,
+            build_dir, streaming, weights, temperature, dedup, _quality_filters(dataset_names, quality),
+            _normalizations(dataset_names, normalize), on_event, rank, world_size, gather, gather_timeout,
+        )
+
 
-    processed_datasets = []
-    for dataset_name in dataset_names:
-        module = importlib.import_module(f".available_dataset.{dataset_name}.processor", package='pklue')
-        processed_datasets.append(module.process(max_examples, split))
+def _build_mixture(
+        dataset_names, max_examples, split, num_workers, executor, seed, cache_dir, cache_max_bytes,
+        build_dir, streaming, weights, temperature, dedup, quality, normalizations, on_event,
+        rank=None, world_size=None, gather=True, gather_timeout=None,
+):
+    if build_dir:
+        cache = BuildDirectory(build_dir)
+    else:
+        cache = DatasetCache(cache_dir, cache_max_bytes) if cache_dir else None
+    own_names = dataset_names if world_size is None else assign_datasets(dataset_names, world_size, max_examples)[rank]
+    args = {
+        dataset_name: (dataset_name, max_examples, split, seed, cache, streaming, quality.get(dataset_name),
+                       normalizations[dataset_name])
+        for dataset_name in dataset_names
+    }
+    # cache keys of this build. its entries are memory-mapped by the returned mixture, so they are never evicted
+    keys = {
+        name: cache_key(name, split, max_examples, seed, quality.get(name), normalizations[name])
+        for name in dataset_names
+    } if cache is not None and seed is not None and not streaming else {}
+    process = _process_dataset if on_event is None else _process_dataset_recorded
+    if num_workers > 1 and len(own_names) > 1 and not streaming:
+        pool_cls = ThreadPoolExecutor if executor == 'thread' else ProcessPoolExecutor
+        with pool_cls(max_workers=min(num_workers, len(own_names))) as pool:
+            # map() keeps the order of 'dataset_names'
+            processed_datasets = list(pool.map(process, *zip(*(args[name] for name in own_names))))
+    else:
+        processed_datasets = [process(*args[name]) for name in own_names]
+    if world_size is not None and gather:
+        # shards of the other ranks are memory-mapped from build_dir once they are written
+        cache.wait({name: keys[name] for name in dataset_names if name not in own_names}, timeout=gather_timeout)
+        own = dict(zip(own_names, processed_datasets))
+        processed_datasets = [own[name] if name in own else process(*args[name]) for name in dataset_names]
+    elif world_size is not None:
+        # a rank gets no dataset when world_size is larger than the number of datasets
+        dataset_names = own_names
+    if on_event is not None:
+        for _, events in processed_datasets:
+            for event in events:
+                on_event(event)
+        processed_datasets = [ds for ds, _ in processed_datasets]
+    if cache is not None:
+        cache.evict(keep=keys)
+    if build_dir and not streaming and (world_size is None or gather and rank == 0):
+        rows = [len(ds) for ds in processed_datasets] if weights is None and temperature is None and not dedup else None
+        cache.write_manifest(dataset_names, split, max_examples, seed, quality, normalizations, rows)
+    if dedup and not streaming:
+        with stage('dedup') as s:
+            processed_datasets = deduplicate_datasets(processed_datasets, near=dedup == 'near', num_proc=num_workers)
+            s.set_result(processed_datasets)
 
-    return concatenate_datasets(processed_datasets)
+    if weights is None and temperature is None:
+        with stage('concatenate') as s:
+            if processed_datasets:
+                mixture = concatenate_datasets(processed_datasets)
+            else:
+                mixture = datasets.Dataset.from_dict({'chat': []}, features=CHAT_FEATURES)
+            s.set_result(mixture)
+    else:
+        sizes = [
+            _known_size(name, ds, split, max_examples) for name, ds in zip(dataset_names, processed_datasets)
+        ] if streaming else None
+        with stage('interleave') as s:
+            mixture = interleave(processed_datasets, weights=weights, temperature=temperature, seed=seed, sizes=sizes)
+            s.set_result(mixture)
+    if dedup and streaming:
+        mixture = deduplicate(mixture, near=dedup == 'near')
+    return mixture
 
 
 if __name__ == '__main__':
@@ -0,0 +1,177 @@
+# Copyright 2023 NLP & AI Lab - Korea University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""quality filters for machine-translated and generated chats
+
+Every turn of a chat column is measured at once over the flat turn contents: its length, the ratio of Hangul
+among its Hangul and latin letters, counted with numpy on the utf-8 bytes, and the ratio of repeated
+sentences.
+A chat is dropped if any of its checked turns is out of the thresholds of a 'QualityFilter'.
+'process_filtered' processes more source rows than max_examples, so that a filtered dataset still has
+max_examples rows when its source has enough.
+
+Example:
+    >>> get_mixture(['alpaca_gpt4_ko', 'klue_nli'], quality={'alpaca_gpt4_ko': QualityFilter(min_hangul_ratio=0.5)})
+"""
+
+from typing import Callable, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from datasets import Dataset, IterableDataset
+
+from .chat import ROLES, chat_arrays
+from .instrument import stage
+from .utils import sample_indices
+
+OVERSAMPLE = 1.25  # rows processed per row needed, on top of the pass rate seen so far
+MAX_ATTEMPTS = 4
+
+# sources translated or generated by a model, which the default filter is meant for
+GENERATED_DATASETS = (
+    'alpaca_gpt4_ko', 'dolly_gpt4_ko', 'aya_ko_gpt4o', 'koalpaca_v1_1_gpt4o', 'xp3x_filtered_gpt4', 'truthfulqa_to_ko',
+)
+
+
+class QualityFilter(NamedTuple):
+    """thresholds of 'quality_mask'. None disables a check."""
+    min_hangul_ratio: Optional[float] = 0.3  # Hangul / (Hangul + latin letters). drops untranslated turns
+    hangul_min_letters: int = 20  # turns with fewer letters, like 'BTS' or '3', skip the Hangul check
+    min_chars: Optional[int] = 1  # drops empty turns
+    max_chars: Optional[int] = 20000  # drops runaway generations
+    max_repetition: Optional[float] = 0.5  # repeated sentences / sentences. drops generations stuck in a loop
+    roles: Tuple[str, ...] = ('user', 'assistant')  # roles of the checked turns
+
+
+class TurnStats(NamedTuple):
+    """statistics of every turn of a chat column, in the order of 'chat_arrays(...).contents'."""
+    chars: np.ndarray
+    letters: np.ndarray  # Hangul syllables and latin letters
+    hangul: np.ndarray
+    repetition: np.ndarray  # 1 - distinct sentences / sentences, 0 for turns of a single sentence
+
+
+def _repetition(contents: pa.Array) -> np.ndarray:
+    sentences = pc.split_pattern_regex(contents, r'[\n.!?。]+')
+    sentence_counts = pc.list_value_length(sentences).to_numpy(zero_copy_only=False)
+    turn_ids = np.repeat(np.arange(len(contents)), sentence_counts)
+    flat = pc.utf8_trim_whitespace(sentences.flatten())
+    nonempty = pc.greater(pc.utf8_length(flat), 0).to_numpy(zero_copy_only=False)
+    turn_ids = turn_ids[nonempty]
+    # a sentence is a repeat if the same turn has the same sentence before it
+    codes = pc.dictionary_encode(pc.filter(flat, nonempty)).indices.to_numpy().astype(np.int64)
+    keys = turn_ids * (codes.max(initial=0) + 1) + codes
+    distinct_turn_ids = np.unique(keys) // (codes.max(initial=0) + 1)
+    total = np.bincount(turn_ids, minlength=len(contents))
+    distinct = np.bincount(distinct_turn_ids, minlength=len(contents))
+    return (total - distinct) / np.maximum(total, 1)
+
+
+def _count_per_string(mask: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    return np.diff(np.searchsorted(np.flatnonzero(mask), offsets))
+
+
+def _letter_counts(contents: pa.LargeStringArray):
+    """(Hangul syllables, latin letters) of every string, from the bytes of its utf-8 encoding.
+
+    Hangul syllables U+AC00..U+D7A3 are 3-byte sequences led by EA..ED. the other characters led by them,
+    like Yi syllables or Hangul Jamo Extended-B, are rare enough to be counted as Hangul too.
+    """
+    _, offsets_buffer, data_buffer = contents.buffers()
+    offsets = np.frombuffer(offsets_buffer, dtype=np.int64)[contents.offset:contents.offset + len(contents) + 1]
+    data = np.frombuffer(data_buffer, dtype=np.uint8)[offsets[0]:offsets[-1]] if data_buffer else np.empty(0, np.uint8)
+    offsets = offsets - offsets[0]
+    hangul = (data - np.uint8(0xEA)) < 4  # wrapping uint8 arithmetic, so one comparison checks a range
+    latin = ((data | np.uint8(0x20)) - np.uint8(ord('a'))) < 26  # lower-cased ascii
+    return _count_per_string(hangul, offsets), _count_per_string(latin, offsets)
+
+
+def turn_stats(contents: Union[pa.Array, pa.ChunkedArray]) -> TurnStats:
+    """length, letter and Hangul counts and sentence repetition of every string of 'contents'."""
+    contents = pc.cast(pc.fill_null(contents, ''), pa.large_string())
+    if isinstance(contents, pa.ChunkedArray):
+        contents = contents.combine_chunks()
+    hangul, latin = _letter_counts(contents)
+    return TurnStats(
+        pc.utf8_length(contents).to_numpy(zero_copy_only=False), hangul + latin, hangul, _repetition(contents),
+    )
+
+
+def quality_mask(chats, config: QualityFilter = QualityFilter()) -> np.ndarray:
+    """boolean mask of a chat column, which is True for every chat to keep."""
+    arrays = chat_arrays(chats)
+    stats = turn_stats(arrays.contents)
+    failed = np.zeros(len(arrays.roles), dtype=bool)
+    if config.min_hangul_ratio is not None:
+        checked = stats.letters >= config.hangul_min_letters
+        failed |= checked & (stats.hangul < config.min_hangul_ratio * stats.letters)
+    if config.min_chars is not None:
+        failed |= stats.chars < config.min_chars
+    if config.max_chars is not None:
+        failed |= stats.chars > config.max_chars
+    if config.max_repetition is not None:
+        failed |= stats.repetition > config.max_repetition
+    failed &= np.isin(arrays.roles, [ROLES.index(role) for role in config.roles])
+
+    num_chats = len(arrays.offsets) - 1
+    chat_ids = np.repeat(np.arange(num_chats), np.diff(arrays.offsets))
+    return np.bincount(chat_ids, weights=failed, minlength=num_chats) == 0
+
+
+def filter_quality(ds: Union[Dataset, IterableDataset], config: QualityFilter = QualityFilter(), batch_size=10000):
+    """Remove chats of 'ds' which fail 'config'. see 'quality_mask'.
+
+    Returns 'select()' view of the kept rows. The mask is computed batch by batch, so a whole source can be
+    filtered with bounded memory. IterableDataset is filtered lazily while iterating.
+    """
+    if isinstance(ds, IterableDataset):
+        return ds.with_format('arrow').filter(
+            lambda batch: quality_mask(batch.column('chat'), config), batched=True, batch_size=batch_size
+        ).with_format()
+
+    with stage('quality') as s:
+        masks = [
+            quality_mask(batch.column('chat'), config)
+            for batch in ds.select_columns(['chat']).with_format('arrow').iter(batch_size=batch_size)
+        ]
+        ds = ds.select(np.flatnonzero(np.concatenate(masks))) if masks else ds
+        s.set_result(ds)
+    return ds
+
+
+def process_filtered(process: Callable[[Optional[int]], Union[Dataset, IterableDataset]], max_examples,
+                     config: QualityFilter = QualityFilter(), streaming=False):
+    """Process rows with 'process(num_rows)' and keep 'max_examples' random rows which pass 'config'.
+
+    The first attempt processes max_examples * OVERSAMPLE rows. If too few pass, the next attempt processes
+    enough rows for the pass rate seen so far, until the source runs out or after MAX_ATTEMPTS attempts,
+    so a dataset comes out smaller than max_examples only if its source does not have enough rows which pass.
+    IterableDataset is filtered lazily, so its pass rate is unknown: it is processed from
+    max_examples * OVERSAMPLE rows in one attempt and may come out smaller.
+    """
+    if not max_examples or streaming:
+        ds = filter_quality(process(max_examples and int(np.ceil(max_examples * OVERSAMPLE))), config)
+        return ds.take(max_examples) if max_examples else ds
+
+    num_rows = int(np.ceil(max_examples * OVERSAMPLE))
+    for _ in range(MAX_ATTEMPTS):
+        ds = process(num_rows)
+        kept = filter_quality(ds, config)
+        if len(kept) >= max_examples or len(ds) < num_rows:  # enough rows, or the whole source
+            break
+        num_rows = int(np.ceil(num_rows * max_examples / max(len(kept), 1) * OVERSAMPLE))
+    if len(kept) > max_examples:
+        kept = kept.select(sample_indices(len(kept), max_examples))
+    return kept
@@ -0,0 +1,74 @@
+# Copyright 2023 NLP & AI Lab - Korea University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""registry of available datasets
+
+Each 'available_dataset/<name>/manifest.yaml' describes a dataset:
+    hf_id: huggingface hub id of the source dataset. null for synthetic datasets.
+    subset: config name of the source dataset, or null.
+    templates: template yaml files used by the processor.
+    approx_size: approximate number of train examples of the source, or null if unknown.
+    splits: splits which the processor supports.
+
+Manifests are read once, and only this module, yaml and the standard library are imported,
+so listing datasets never imports 'datasets', processors or their optional dependencies.
+"""
+
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+import importlib
+
+import yaml
+
+DATASET_DIR = Path(__file__).parent / "available_dataset"
+
+
+class DatasetInfo(NamedTuple):
+    name: str
+    hf_id: Optional[str]
+    subset: Optional[str]
+    templates: List[str]
+    approx_size: Optional[int]
+    splits: List[str]
+
+
+@lru_cache(maxsize=None)
+def _registry() -> Dict[str, DatasetInfo]:
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    registry = {}
+    for manifest_file in sorted(DATASET_DIR.glob("*/manifest.yaml")):
+        with open(manifest_file, 'rt', encoding='utf-8') as f:
+            manifest = yaml.load(f, Loader=loader)
+        name = manifest_file.parent.name
+        registry[name] = DatasetInfo(name=name, **manifest)
+    return registry
+
+
+def list_datasets() -> List[str]:
+    """names of every available dataset."""
+    return list(_registry())
+
+
+def get_info(name) -> DatasetInfo:
+    try:
+        return _registry()[name]
+    except KeyError:
+        raise ValueError(f"Invalid dataset name: '{name}'. available: {list_datasets()}") from None
+
+
+def load_processor(name):
+    """import the processor module of a dataset. it is imported only when first selected."""
+    get_info(name)
+    return importlib.import_module(f".available_dataset.{name}.processor", package='pklue')
@@ -0,0 +1,79 @@
+# Copyright 2023 NLP & AI Lab - Korea University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""counter-based random streams of the mixture pipeline
+
+Every dataset of a seeded build gets its own Philox stream, keyed by a hash of the seed and the dataset name.
+Pipeline code asks 'generator()' for a new generator at every random step, and the n-th generator of a stream
+starts at counter n, so the steps never overlap and the output of a dataset does not depend on the other
+datasets, the number of workers, or whether they are threads or processes.
+Outside of 'seeded()', generators are seeded from the global numpy random state as before.
+"""
+
+from contextlib import contextmanager
+import hashlib
+import threading
+
+import numpy as np
+
+_local = threading.local()
+
+
+class _Stream:
+    def __init__(self, key):
+        self.key = key
+        self.counter = 0
+
+    def generator(self) -> np.random.Generator:
+        # the highest counter word numbers the generators, and the lower words count the draws of each one
+        bit_generator = np.random.Philox(key=self.key, counter=[0, 0, 0, self.counter])
+        self.counter += 1
+        return np.random.Generator(bit_generator)
+
+
+def stream_key(seed, dataset_name) -> np.ndarray:
+    """128-bit Philox key of a dataset's stream."""
+    digest = hashlib.sha256(f"{seed}:{dataset_name}".encode('utf-8')).digest()
+    return np.frombuffer(digest[:16], dtype=np.uint64).copy()
+
+
+@contextmanager
+def seeded(seed, dataset_name):
+    """draw the generators of this thread from the stream of 'dataset_name'. does nothing if seed is None."""
+    previous = getattr(_local, 'stream', None)
+    if seed is not None:
+        _local.stream = _Stream(stream_key(seed, dataset_name))
+    try:
+        yield
+    finally:
+        _local.stream = previous
+
+
+def generator() -> np.random.Generator:
+    """a new generator, independent of every generator drawn before it in the current stream."""
+    stream = getattr(_local, 'stream', None)
+    if stream is None:
+        return np.random.default_rng(np.random.randint(2 ** 32, dtype=np.uint64))
+    return stream.generator()
+
+
+def draw_seed() -> int:
+    """a 32-bit seed for APIs which take an int, like 'IterableDataset.shuffle'."""
+    return int(generator().integers(2 ** 32, dtype=np.uint64))
+
+
+def batch_generator(seed, batch_start) -> np.random.Generator:
+    """generator of the batch starting at row 'batch_start' of a lazily mapped IterableDataset.
+    'seed' comes from 'draw_seed()', so iterating the dataset again draws the same values."""
+    return np.random.Generator(np.random.Philox(key=[seed, batch_start]))
@@ -0,0 +1,130 @@
+# Copyright 2023 NLP & AI Lab - Korea University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""synthetic Korean long-context chats for memory and throughput tests
+
+Text is made of frequent Hangul syllables, spaces and sentence ends, drawn with numpy for a whole chunk of rows
+at once and encoded to utf-8 directly into the buffers of an arrow string array, so no python string is built.
+
+Example:
+    >>> ds = synthetic_chats(num_rows=1000, num_turns=2, turn_tokens=16384, tokenize=lambda t: tokenizer(t)['input_ids'])
+"""
+
+from typing import Iterator
+
+import numpy as np
+import pyarrow as pa
+from datasets import Dataset, IterableDataset
+
+from .chat import ASSISTANT, CHAT_FEATURES, CHAT_TYPE, USER, chat_array
+from .packing import Tokenize
+from .rng import generator
+
+_SYLLABLES = np.array([ord(c) for c in (
+    "가각간갈감강개거건것게겠결경계고공과관교구국군규그근글금기길김까나날남내너넣네년노는니다단달당대더데도동되된될"
+    "두든들듯등따때또라람랑래러럼렇레려력로록론료루르를른리린림마만많말맞매머먹면명모목무문물미민바받발방배백번법변"
+    "보본부분불비사산살상새생서선설성세소속수시식신실심아안않알았야약양어억언얼업없었에여역연열영예오온와외요용우운"
+    "원위유으은을음의이인일임입있자작잘장재저적전정제조족종주중지직진질집차참처천체초추치크타터토통트파판편평포표프"
+    "하학한할함합해했행현형호화확회후히"
+)], dtype=np.uint32)
+_SPACE, _PERIOD, _DA = ord(' '), ord('.'), ord('다')
+SPACE_RATIO = 0.25  # words are about 3 syllables long
+SENTENCE_END_RATIO = 0.1  # of the spaces, so sentences are about 10 words long
+
+
+def _utf8(codepoints: np.ndarray) -> np.ndarray:
+    """utf-8 bytes of codepoints which are either ascii or 3-byte, like Hangul syllables."""
+    widths = np.where(codepoints < 0x80, 1, 3)
+    starts = np.cumsum(widths) - widths
+    data = np.empty(int(widths.sum()), dtype=np.uint8)
+    ascii_ = codepoints < 0x80
+    data[starts[ascii_]] = codepoints[ascii_]
+    wide, cp = starts[~ascii_], codepoints[~ascii_]
+    data[wide] = 0xE0 | (cp >> 12)
+    data[wide + 1] = 0x80 | ((cp >> 6) & 0x3F)
+    data[wide + 2] = 0x80 | (cp & 0x3F)
+    return data
+
+
+def synthetic_texts(lengths, rng: np.random.Generator) -> pa.LargeStringArray:
+    """texts of exactly lengths[i] characters."""
+    lengths = np.asarray(lengths, dtype=np.int64)
+    char_offsets = np.concatenate([[0], np.cumsum(lengths)])
+    n = int(char_offsets[-1])
+    codepoints = _SYLLABLES[rng.integers(len(_SYLLABLES), size=n)]
+    spaces = np.flatnonzero(rng.random(n) < SPACE_RATIO)
+    codepoints[spaces] = _SPACE
+    ends = spaces[(rng.random(len(spaces)) < SENTENCE_END_RATIO) & (spaces > 0) & (spaces < n - 1)]
+    codepoints[ends - 1] = _DA
+    codepoints[ends] = _PERIOD
+    codepoints[ends + 1] = _SPACE
+    # every text starts with a syllable and ends with a sentence end
+    starts = char_offsets[:-1][lengths > 0]
+    codepoints[starts] = _SYLLABLES[rng.integers(len(_SYLLABLES), size=len(starts))]
+    codepoints[char_offsets[1:][lengths > 0] - 1] = _PERIOD
+
+    data = _utf8(codepoints)
+    byte_offsets = np.concatenate([[0], np.cumsum(np.where(codepoints < 0x80, 1, 3))])[char_offsets]
+    return pa.LargeStringArray.from_buffers(len(lengths), pa.py_buffer(byte_offsets), pa.py_buffer(data))
+
+
+def chars_per_token(tokenize: Tokenize, sample_chars=20000) -> float:
+    """characters of synthetic text per token of 'tokenize', measured on a fixed sample."""
+    sample = synthetic_texts([sample_chars], np.random.default_rng(0))
+    return sample_chars / len(tokenize(sample.to_pylist())[0])
+
+
+def _chunks(num_rows, num_turns, turn_chars, chunk_rows, rng) -> Iterator[pa.RecordBatch]:
+    for start in range(0, num_rows, chunk_rows):
+        rows = min(chunk_rows, num_rows - start)
+        contents = synthetic_texts(np.full(rows * num_turns, turn_chars), rng)
+        roles = np.tile([USER, ASSISTANT], (num_turns + 1) // 2)[:num_turns]
+        chats = chat_array(np.arange(rows + 1) * num_turns, np.tile(roles, rows), contents)
+        yield pa.RecordBatch.from_arrays([chats], names=['chat'])
+
+
+def synthetic_chats(
+        num_rows: int = 1000,
+        num_turns: int = 8,
+        turn_chars: int = 1000,
+        turn_tokens: int = None,
+        tokenize: Tokenize = None,
+        chunk_rows: int = 64,
+        streaming: bool = False,
+        rng: np.random.Generator = None,
+):
+    """Chats of 'num_turns' turns alternating user and assistant, every turn 'turn_chars' characters long.
+
+    Args:
+        turn_tokens: if given with 'tokenize', the turn length in tokens of that tokenizer instead of turn_chars.
+            the characters per token are measured once on a sample of synthetic text.
+        chunk_rows: rows generated at once. a Dataset is an arrow table of these chunks.
+        streaming: if True, returns IterableDataset generating chunks while iterating.
+        rng: defaults to the next generator of the current stream of 'pklue.rng'.
+    """
+    if turn_tokens is not None:
+        assert tokenize is not None, "turn_tokens needs tokenize."
+        turn_chars = int(np.ceil(turn_tokens * chars_per_token(tokenize)))
+    rng = rng if rng is not None else generator()
+    if streaming:
+        seed = int(rng.integers(2 ** 32))
+
+        def generate_rows():
+            # a new generator for every pass, so that iterating again gives the same chats
+            for batch in _chunks(num_rows, num_turns, turn_chars, chunk_rows, np.random.default_rng(seed)):
+                yield from batch.to_pylist()
+
+        return IterableDataset.from_generator(generate_rows, features=CHAT_FEATURES)
+    batches = list(_chunks(num_rows, num_turns, turn_chars, chunk_rows, rng))
+    return Dataset(pa.Table.from_batches(batches, schema=pa.schema([('chat', CHAT_TYPE)])))
@@ -0,0 +1,136 @@
+# Copyright 2023 NLP & AI Lab - Korea University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""precompiled store of every 'available_dataset/*/template*.yaml'
+
+Template files are parsed with the C yaml loader if it is available, and compiled into render plans.
+The plans are kept in memory and pickled to a cache file, keyed by the mtime and size of every template file,
+so later processes skip yaml parsing, and only an edited template is parsed again.
+"""
+
+from pathlib import Path
+from string import Formatter
+from typing import Dict, Iterable, List
+import os
+import pickle
+
+import yaml
+
+from .korean_utils import PARTICLES
+
+DATASET_DIR = Path(__file__).parent / "available_dataset"
+CACHE_FILE = Path(os.environ.get('XDG_CACHE_HOME', '~/.cache')).expanduser() / 'pklue' / 'templates.pickle'
+# bump when the compiled form changes, so that old cache files are ignored
+STORE_VERSION = 1
+
+
+def compile_template(template):
+    """precompile {key: format string} template into {key: [(literal, field_name or None, particle or None), ...]}.
+
+    A field may ask for a particle chosen by its last character, like '{word:은/는}' or '{question:(으)로}'.
+    see korean_utils.PARTICLES for the available particles.
+    """
+    plan = {key: [
+        (literal, field_name, spec or None) for literal, field_name, spec, _ in Formatter().parse(fmt)
+    ] for key, fmt in template.items()}
+    for key_plan in plan.values():
+        for _, _, spec in key_plan:
+            if spec is not None and spec not in PARTICLES:
+                raise ValueError(f"unknown particle '{spec}' in template. available: {list(PARTICLES)}")
+    return plan
+
+
+def field_names(plans) -> set:
+    """names of every field used by compiled templates."""
+    return {f for plan in plans for key_plan in plan.values() for _, f, _ in key_plan if f is not None}
+
+
+def validate_fields(plans, columns: Iterable[str]):
+    """raise ValueError before any row is rendered if templates use a field which is not in 'columns'."""
+    missing = field_names(plans) - set(columns)
+    if missing:
+        raise ValueError(f"template fields {sorted(missing)} are not columns of the dataset: {sorted(columns)}")
+
+
+def _fingerprint(path: Path):
+    stat = path.stat()
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _compile_file(path: Path) -> Dict[str, List[dict]]:
+    loader = getattr(yaml, 'CBaseLoader', yaml.BaseLoader)  # every scalar stays a string
+    with open(path, 'rt', encoding='utf-8') as f:
+        parsed = yaml.load(f, Loader=loader)
+    try:
+        return {key: [compile_template(t) for t in templates] for key, templates in parsed.items()}
+    except ValueError as e:
+        raise ValueError(f"{path}: {e}") from e
+
+
+# {path relative to DATASET_DIR: (fingerprint, {yaml key: [compiled template, ...]})} loaded in this process
+_entries = None
+
+
+def _load_cache_file():
+    try:
+        with open(CACHE_FILE, 'rb') as f:
+            version, cached = pickle.load(f)
+        return cached if version == STORE_VERSION else {}
+    except (OSError, pickle.PickleError, EOFError, ValueError):
+        return {}
+
+
+def _store() -> Dict[str, Dict[str, List[dict]]]:
+    """{path relative to DATASET_DIR: {yaml key: [compiled template, ...]}}
+
+    template files are checked by their mtime and size on every call, so a template edited while
+    the process runs is recompiled, and the other templates are reused.
+    """
+    global _entries
+    cached = _load_cache_file() if _entries is None else _entries
+    paths = {str(p.relative_to(DATASET_DIR)): p for p in sorted(DATASET_DIR.glob("*/template*.yaml"))}
+
+    entries = {}
+    for name, path in paths.items():
+        fingerprint = _fingerprint(path)
+        if name in cached and cached[name][0] == fingerprint:
+            entries[name] = cached[name]
+        else:
+            entries[name] = (fingerprint, _compile_file(path))
+
+    if entries.keys() != cached.keys() or any(entries[name] is not cached[name] for name in entries):
+        try:
+            CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = CACHE_FILE.with_suffix(f'.{os.getpid()}.tmp')
+            with open(tmp_file, 'wb') as f:
+                pickle.dump((STORE_VERSION, entries), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, CACHE_FILE)
+        except OSError:  # the cache is optional, e.g. on a read-only home directory
+            pass
+    _entries = entries
+    return {name: compiled for name, (_, compiled) in entries.items()}
+
+
+def load_templates(path, key: str = None) -> List[dict]:
+    """compiled templates of a template yaml file, to be given to 'make_random_template_data'.
+
+    Args:
+        path: path of a 'template*.yaml' file in a dataset directory, e.g. Path(__file__).parent / "template.yaml".
+        key: top-level key of the yaml file. may be omitted if the file has only one key.
+    """
+    compiled = _store()[str(Path(path).resolve().relative_to(DATASET_DIR.resolve()))]
+    if key is None:
+        assert len(compiled) == 1, f"{path} has several keys {list(compiled)}, so 'key' is needed."
+        key = next(iter(compiled))
+    return compiled[key]
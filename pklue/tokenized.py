@@ -0,0 +1,190 @@
+# Copyright 2023 NLP & AI Lab - Korea University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""pre-tokenized get_mixture output as memory-mapped token arrays
+
+Chats are rendered to text segments by a chat template function, tokenized batch by batch in 'num_proc'
+processes, and written to flat files: 'tokens.bin' of uint32 token ids, 'loss_mask.bin' of one byte per
+token which is 1 for tokens of assistant segments, and 'offsets.bin' of int64 so that row i is tokens
+offsets[i]:offsets[i + 1]. The files are cached under 'cache_dir/<key>/', keyed by the mixture, the chat
+template and the tokenizer fingerprint, and read back with np.memmap without copying.
+
+Example:
+    >>> tokens = tokenize_mixture(get_mixture(['kullm_v2'], seed=42), chatml,
+    ...                           lambda texts: tokenizer(texts, add_special_tokens=False)['input_ids'],
+    ...                           'tokenized', tokenizer_fingerprint=tokenizer.name_or_path, num_proc=8)
+    >>> input_ids, loss_mask = tokens[0]
+"""
+
+from itertools import chain
+from pathlib import Path
+from typing import Callable, List, Tuple
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+import pyarrow as pa
+from datasets import Dataset, Features
+from datasets.fingerprint import Hasher
+
+from .chat import to_tuples
+from .packing import Tokenize
+
+# renders a chat of (role, content) turns to (text, trained) segments, see 'chatml'
+RenderChat = Callable[[List[Tuple[str, str]]], List[Tuple[str, bool]]]
+
+TOKENS_FILE, LOSS_MASK_FILE, OFFSETS_FILE, META_FILE = 'tokens.bin', 'loss_mask.bin', 'offsets.bin', 'meta.json'
+_TOKENIZED_FEATURES = Features.from_arrow_schema(pa.schema([
+    ('input_ids', pa.list_(pa.uint32())), ('loss_mask', pa.list_(pa.uint8())),
+]))
+
+
+def chatml(chat: List[Tuple[str, str]]) -> List[Tuple[str, bool]]:
+    """ChatML segments of a chat. only the content and end tag of assistant turns are trained."""
+    segments = []
+    for role, content in chat:
+        segments.append((f"<|im_start|>{role}\n", False))
+        segments.append((f"{content}<|im_end|>\n", role == 'assistant'))
+    return segments
+
+
+def _tokenize_batch(batch: pa.Table, render: RenderChat, tokenize: Tokenize):
+    rendered = [render(chat) for chat in to_tuples(batch.column('chat'))]
+    texts = [text for segments in rendered for text, _ in segments]
+    ids = tokenize(texts)
+    segment_lengths = np.fromiter((len(s) for s in ids), dtype=np.int64, count=len(ids))
+    trained = np.fromiter((t for segments in rendered for _, t in segments), dtype=np.uint8, count=len(texts))
+    segment_offsets = np.cumsum([0] + [len(segments) for segments in rendered])
+    token_offsets = np.concatenate([[0], np.cumsum(segment_lengths)])[segment_offsets]
+    tokens = np.fromiter(chain.from_iterable(ids), dtype=np.uint32, count=int(segment_lengths.sum()))
+    row_offsets = pa.array(token_offsets, type=pa.int32())
+    return pa.table({
+        'input_ids': pa.ListArray.from_arrays(row_offsets, pa.array(tokens)),
+        'loss_mask': pa.ListArray.from_arrays(row_offsets, pa.array(np.repeat(trained, segment_lengths))),
+    })
+
+
+def _flat_values(column: pa.ChunkedArray) -> Tuple[np.ndarray, np.ndarray]:
+    """flat values of a list column and the length of every row."""
+    column = column.combine_chunks()
+    offsets = column.offsets.to_numpy()
+    return column.values.slice(offsets[0], offsets[-1] - offsets[0]).to_numpy(), np.diff(offsets)
+
+
+def _memmap(path: Path, dtype):
+    # np.memmap can not map an empty file
+    return np.memmap(path, dtype=dtype, mode='r') if path.stat().st_size else np.zeros(0, dtype=dtype)
+
+
+class TokenizedMixture:
+    """memory-mapped token arrays written by 'tokenize_mixture'.
+
+    'tokens[i]' is (input_ids, loss_mask) of row i, views of the mapped files. loss_mask is bool.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / META_FILE, 'rt', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.input_ids = _memmap(self.path / TOKENS_FILE, np.uint32)
+        self.loss_mask = _memmap(self.path / LOSS_MASK_FILE, np.bool_)
+        self.offsets = _memmap(self.path / OFFSETS_FILE, np.int64)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.input_ids[start:end], self.loss_mask[start:end]
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+
+def tokenized_key(ds: Dataset, render: RenderChat, tokenize: Tokenize, tokenizer_fingerprint: str = None):
+    """cache key of the mixture 'ds' rendered by 'render' and tokenized by 'tokenize'."""
+    key = {
+        'data': ds._fingerprint,
+        'render': Hasher.hash(render),
+        'tokenizer': tokenizer_fingerprint if tokenizer_fingerprint is not None else Hasher.hash(tokenize),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def tokenize_mixture(
+        ds: Dataset,
+        render: RenderChat,
+        tokenize: Tokenize,
+        cache_dir: str,
+        tokenizer_fingerprint: str = None,
+        num_proc: int = None,
+        batch_size: int = 1000,
+) -> TokenizedMixture:
+    """Render and tokenize the 'chat' column of 'ds' into memory-mapped token arrays under 'cache_dir'.
+
+    Args:
+        ds: dataset with 'chat' column, like the output of 'get_mixture'.
+        render: chat template function. maps a chat of (role, content) turns to (text, trained) segments,
+            whose tokens are concatenated and have loss_mask = trained. e.g. 'chatml'.
+        tokenize: callable which maps a batch of texts to a batch of token ids.
+            e.g. lambda texts: tokenizer(texts, add_special_tokens=False)['input_ids']
+        cache_dir: directory of the cached token arrays. created if it does not exist.
+        tokenizer_fingerprint: string which identifies the tokenizer, like its name and revision.
+            defaults to the hash of 'tokenize' and everything it refers to, which is slower for large tokenizers.
+        num_proc: the number of tokenizing processes.
+        batch_size: rows tokenized at once.
+    Returns:
+        TokenizedMixture. the arrays are reused as long as ds, render and the tokenizer are unchanged.
+    """
+    cache_dir = Path(cache_dir).expanduser()
+    key = tokenized_key(ds, render, tokenize, tokenizer_fingerprint)
+    entry_dir = cache_dir / key
+    if (entry_dir / META_FILE).exists():
+        return TokenizedMixture(entry_dir)
+
+    tmp_dir = cache_dir / f".tmp-{uuid.uuid4().hex}"
+    tmp_dir.mkdir(parents=True)
+    tokenized = ds.select_columns(['chat']).with_format('arrow').map(
+        _tokenize_batch, fn_kwargs={'render': render, 'tokenize': tokenize},
+        batched=True, batch_size=batch_size, remove_columns=['chat'], features=_TOKENIZED_FEATURES,
+        num_proc=num_proc, cache_file_name=str(tmp_dir / 'arrow' / 'tokenized.arrow'),
+    )
+    lengths = []
+    num_trained = 0
+    with open(tmp_dir / TOKENS_FILE, 'wb') as tokens_file, open(tmp_dir / LOSS_MASK_FILE, 'wb') as mask_file:
+        for batch in tokenized.iter(batch_size=batch_size):
+            tokens, batch_lengths = _flat_values(batch.column('input_ids'))
+            mask, _ = _flat_values(batch.column('loss_mask'))
+            tokens.tofile(tokens_file)
+            mask.tofile(mask_file)
+            lengths.append(batch_lengths)
+            num_trained += int(mask.sum())
+    del tokenized
+    shutil.rmtree(tmp_dir / 'arrow')
+    offsets = np.concatenate([[0]] + lengths).cumsum().astype(np.int64)
+    offsets.tofile(tmp_dir / OFFSETS_FILE)
+    with open(tmp_dir / META_FILE, 'wt', encoding='utf-8') as f:
+        json.dump({
+            'key': key, 'data': ds._fingerprint, 'tokenizer': tokenizer_fingerprint,
+            'rows': len(offsets) - 1, 'tokens': int(offsets[-1]), 'trained_tokens': num_trained,
+        }, f, indent=2)
+    if entry_dir.exists():  # written concurrently by another run
+        shutil.rmtree(tmp_dir)
+    else:
+        os.replace(tmp_dir, entry_dir)
+    return TokenizedMixture(entry_dir)
@@ -14,9 +14,25 @@
 
 """utility functions"""
 
-from random import choice
+from typing import Union
 
-from datasets import Dataset, load_dataset
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from datasets import Dataset, IterableDataset
+
+from .chat import CHAT_FEATURES, chat_column, from_pairs, group_chats, pair_chat
+from .instrument import stage
+from .korean_utils import particle
+from .mirror import resolve_dataset
+from .normalize import normalize_text
+from .rng import batch_generator, draw_seed, generator
+from .templates import compile_template, field_names, validate_fields
+
+# rows held by the shuffle buffer when subsampling a streamed dataset
+STREAMING_BUFFER_SIZE = 10000
+# template choice of every row of a lazily templated dataset. see 'make_lazy_template_chat'
+TEMPLATE_INDEX_COLUMN = 'template_idx'
 
 
 def list_to_dataset(l, truncate=None):
@@ -37,40 +53,284 @@ def _make_options_str(*options):
     return '\n'.join(l)
 
 
-def make_random_template_data(given_templates, data):
-    def replace_xa0_if_str(x):
-        if isinstance(x, str):
-            x = x.replace(u'\xa0', u'')
-        return x
+def _field_to_str(column):
+    """same string as str(x) of format_map, computed on the whole arrow column.
+    strings are used as they are, since sources are normalized when they are loaded. see pklue.normalize."""
+    if pa.types.is_integer(column.type):
+        column = pc.cast(column, pa.string())
+    elif not (pa.types.is_string(column.type) or pa.types.is_large_string(column.type)):
+        column = pa.array([str(x) for x in column.to_pylist()], type=pa.string())
+    return pc.fill_null(column, 'None')
+
+
+def _render_plan(plan, columns, num_rows):
+    pieces = []
+    for literal, field_name, particle_name in plan:
+        if literal:
+            pieces.append(pa.scalar(literal))
+        if field_name is not None:
+            pieces.append(columns[field_name])
+        if particle_name is not None:
+            pieces.append(particle(columns[field_name], particle_name))
+    if not any(isinstance(p, (pa.Array, pa.ChunkedArray)) for p in pieces):
+        return pa.array([''.join(p.as_py() for p in pieces)] * num_rows, type=pa.string())
+    if len(pieces) == 1:
+        return pieces[0]
+    return pc.binary_join_element_wise(*pieces, '')
+
+
+def _render_batch(batch: pa.Table, plans, choices):
+    """render every row of 'batch' with plans[choices[row]]."""
+    columns = {f: _field_to_str(batch.column(f)) for f in field_names(plans)}
+    rendered = {key: [] for key in plans[0]}
+    row_order = []
+    for template_idx in np.unique(choices):
+        rows = np.flatnonzero(choices == template_idx)
+        row_order.append(rows)
+        sub_columns = {f: pc.take(c, rows) for f, c in columns.items()}
+        for key, plan in plans[template_idx].items():
+            rendered[key].append(_render_plan(plan, sub_columns, len(rows)))
+    inverse = np.argsort(np.concatenate(row_order), kind='stable')
+    return pa.table({
+        key: pc.take(pa.chunked_array(parts).combine_chunks(), inverse) for key, parts in rendered.items()
+    })
+
 
-    new_ds = Dataset.from_list([
-        {k: v.format_map(
-            {k2: replace_xa0_if_str(v2) for k2, v2 in item.items()}  # sometimes u'\xa0' appears, so replace it.
-        ) for k, v in choice(given_templates).items()} for item in data
-    ])
+def _compile_plans(given_templates):
+    plans = [t if all(isinstance(v, list) for v in t.values()) else compile_template(t) for t in given_templates]
+    assert all(plan.keys() == plans[0].keys() for plan in plans), "every template must have the same keys."
+    return plans
 
+
+def make_random_template_data(given_templates, data: Union[Dataset, IterableDataset], num_proc=None, batch_size=1000):
+    """fill a randomly chosen template for every row of 'data'.
+
+    'given_templates' are compiled templates from 'templates.load_templates', or {key: format string} dicts.
+    Fields of the templates are checked against the columns of 'data' before any row is rendered.
+    The template of every row is drawn with a single numpy call,
+    and rows are rendered in batches with arrow string kernels through 'Dataset.map'.
+    Templates are drawn from the current dataset's stream of 'pklue.rng'.
+    For IterableDataset, templates are drawn per batch and rendered lazily while iterating.
+    Returns dataset whose columns are the keys of the templates.
+    """
+    plans = _compile_plans(given_templates)
+    columns = data.column_names if data.column_names is not None else list(data.features or [])
+    if columns:
+        validate_fields(plans, columns)
+
+    if isinstance(data, IterableDataset):
+        seed = draw_seed()
+        new_ds = data.with_format('arrow').map(
+            lambda batch, indices: _render_batch(
+                batch, plans, batch_generator(seed, indices[0]).integers(len(plans), size=len(batch))
+            ),
+            batched=True,
+            batch_size=batch_size,
+            with_indices=True,
+        )
+        # columns of a mapped IterableDataset can be unknown, so keep only the rendered ones
+        return new_ds.select_columns(list(plans[0])).with_format()
+
+    with stage('template') as s:
+        choices = generator().integers(len(plans), size=len(data), dtype=np.uint16)
+        new_ds = data.with_format('arrow').map(
+            lambda batch, indices: _render_batch(batch, plans, choices[indices]),
+            batched=True,
+            batch_size=batch_size,
+            with_indices=True,
+            remove_columns=data.column_names,
+            num_proc=num_proc,
+        ).with_format()
+        s.set_result(new_ds)
     return new_ds
 
 
-def convert_to_chat(data: Dataset):
-    original_column_names = {'prompt', 'completion'}
-    assert set(data.column_names) == original_column_names
-    new_data = data.map(
-        lambda item: {'chat': [
-            ('user', item['prompt']), ('assistant', item['completion'])
-        ]},
-        remove_columns=list(original_column_names)
+class _LazyChat:
+    """'set_transform' function rendering the chat of every accessed row with plans[template_idx]."""
+
+    def __init__(self, plans):
+        self.plans = plans
+
+    def __call__(self, batch):
+        table = pa.table(batch)
+        rendered = _render_batch(table, self.plans, table.column(TEMPLATE_INDEX_COLUMN).to_numpy())
+        return {'chat': pair_chat(rendered.column('prompt'), rendered.column('completion')).to_pylist()}
+
+
+def make_lazy_template_chat(given_templates, data: Dataset) -> Dataset:
+    """'convert_to_chat(make_random_template_data(given_templates, data))', rendered on access.
+
+    Keeps only the template fields of 'data' and a uint16 'template_idx' column, so long passages are stored once
+    instead of being copied into every prompt. Indexing or iterating the result renders the 'chat' of the accessed
+    rows in one batch through 'set_transform'. Call 'resample_templates' to draw new templates, e.g. every epoch.
+    The transform is not saved by 'save_to_disk', so call 'lazy_template_chat' again on a reloaded dataset.
+    """
+    plans = _compile_plans(given_templates)
+    assert set(plans[0]) == {'prompt', 'completion'}, "templates must have 'prompt' and 'completion' keys."
+    validate_fields(plans, data.column_names)
+    with stage('template') as s:
+        new_ds = data.select_columns(sorted(field_names(plans)))
+        new_ds = new_ds.add_column(
+            TEMPLATE_INDEX_COLUMN, generator().integers(len(plans), size=len(new_ds), dtype=np.uint16)
+        )
+        s.set_result(new_ds)
+    return lazy_template_chat(given_templates, new_ds)
+
+
+def lazy_template_chat(given_templates, data: Dataset) -> Dataset:
+    """set the transform of 'make_lazy_template_chat' on a dataset which has the template fields and 'template_idx'."""
+    plans = _compile_plans(given_templates)
+    validate_fields(plans, data.column_names)
+    assert TEMPLATE_INDEX_COLUMN in data.column_names, f"'{TEMPLATE_INDEX_COLUMN}' column is needed."
+    return data.with_transform(_LazyChat(plans))
+
+
+def resample_templates(data: Dataset, given_templates, rng: np.random.Generator = None) -> Dataset:
+    """draw a new template for every row of a 'make_lazy_template_chat' dataset without rendering anything.
+
+    rng defaults to the next generator of the current stream of 'pklue.rng',
+    so pass np.random.default_rng([seed, epoch]) for a reproducible choice per epoch.
+    """
+    rng = rng if rng is not None else generator()
+    plans = _compile_plans(given_templates)
+    new_ds = data.with_format().remove_columns([TEMPLATE_INDEX_COLUMN])
+    new_ds = new_ds.add_column(TEMPLATE_INDEX_COLUMN, rng.integers(len(plans), size=len(new_ds), dtype=np.uint16))
+    return lazy_template_chat(plans, new_ds)
+
+
+def _pair_chat_batch(batch: pa.Table):
+    return pa.table({'chat': pair_chat(batch.column('prompt'), batch.column('completion'))})
+
+
+def _pairs_to_chat_batch(batch: pa.Table):
+    return pa.table({'chat': from_pairs(batch.column('chat'))})
+
+
+def _map_chat(data: Union[Dataset, IterableDataset], function, columns, batch_size):
+    new_data = data.with_format('arrow').map(
+        function, batched=True, batch_size=batch_size, remove_columns=columns, features=CHAT_FEATURES
     )
+    return new_data.with_format()
+
+
+def convert_to_chat(data: Union[Dataset, IterableDataset], batch_size=1000):
+    """make 'prompt', 'completion' columns into 'chat' column of [user: prompt, assistant: completion]."""
+    original_column_names = {'prompt', 'completion'}
+    assert data.column_names is None or set(data.column_names) == original_column_names
+    with stage('chat') as s:
+        new_data = _map_chat(data, _pair_chat_batch, list(original_column_names), batch_size)
+        s.set_result(new_data)
     return new_data
 
 
-def load_dataset_max_examples(dataset_name, split=None, max_examples=None, subset: str = None):
-    if subset and split:
-        ds = load_dataset(dataset_name, subset, split=split)
-    elif split:
-        ds = load_dataset(dataset_name, split=split)
-    else:
-        ds = load_dataset(dataset_name)
-    if max_examples and max_examples < len(ds):
-        ds = ds.train_test_split(train_size=max_examples)['train']
+def convert_pairs_to_chat(data: Union[Dataset, IterableDataset], batch_size=1000):
+    """convert 'chat' column of [role, content] string pairs, which some source datasets use, to the chat column."""
+    with stage('chat') as s:
+        # the new 'chat' column replaces the old one, so nothing is removed
+        new_data = _map_chat(data.select_columns(['chat']), _pairs_to_chat_batch, None, batch_size)
+        s.set_result(new_data)
+    return new_data
+
+
+def multiturn_group_sizes(num_rows, turn_ratios, max_examples=None):
+    """the number of chats joined into each multiturn chat, when num_rows chats are merged.
+
+    Args:
+        turn_ratios: {turns: ratio of the chats which are merged into chats of 'turns' turns}, like {2: 0.2, 3: 0.1}.
+            the rest are kept as they are.
+        max_examples: if given, single chats are dropped so that at most max_examples chats are made.
+    Returns:
+        group sizes in ascending order, e.g. [1, 1, ..., 2, 2, ..., 3, ...].
+    """
+    assert sum(turn_ratios.values()) <= 1, "turn ratios must sum to 1 or less."
+    groups = {turns: int(num_rows * ratio) // turns for turns, ratio in turn_ratios.items() if turns > 1}
+    groups[1] = num_rows - sum(turns * count for turns, count in groups.items())
+    if max_examples is not None and sum(groups.values()) > max_examples:
+        groups[1] = max(groups[1] - (sum(groups.values()) - max_examples), 0)
+    turns = sorted(groups)
+    return np.repeat(turns, [groups[t] for t in turns])
+
+
+def multiturn_source_rows(max_examples, turn_ratios):
+    """the number of single chats which 'merge_multiturn' needs to make max_examples chats."""
+    if not max_examples:
+        return max_examples
+    kept_ratio = 1 - sum(ratio * (turns - 1) / turns for turns, ratio in turn_ratios.items() if turns > 1)
+    return int(np.ceil(max_examples / kept_ratio)) + max(turn_ratios)
+
+
+def merge_multiturn(data: Union[Dataset, IterableDataset], turn_ratios, max_examples=None, batch_size=1000):
+    """join randomly grouped chats of 'data' into multiturn chats. see 'multiturn_group_sizes' for the arguments.
+
+    A Dataset is grouped with one permutation of its row indices, and every group is joined by recomputing
+    list offsets of the chat column, so no row is decoded. An IterableDataset is grouped within each batch,
+    so shuffle it beforehand. Subsample single chats to 'multiturn_source_rows(max_examples)' before merging
+    to avoid processing rows which are dropped.
+    """
+    if isinstance(data, IterableDataset):
+        seed = draw_seed()
+
+        def merge_batch(batch: pa.Table, indices):
+            chats = pc.take(batch.column('chat'), batch_generator(seed, indices[0]).permutation(len(batch)))
+            return pa.table({'chat': group_chats(chats, multiturn_group_sizes(len(batch), turn_ratios))})
+
+        new_data = data.with_format('arrow').map(
+            merge_batch, batched=True, batch_size=batch_size, with_indices=True, features=CHAT_FEATURES
+        ).with_format()
+        return new_data.take(max_examples) if max_examples else new_data
+
+    with stage('multiturn') as s:
+        group_sizes = multiturn_group_sizes(len(data), turn_ratios, max_examples)
+        order = generator().permutation(len(data))[:group_sizes.sum()]
+        chats = chat_column(data, order)
+        new_data = Dataset(pa.table({'chat': group_chats(chats, group_sizes)}))
+        s.set_result(new_data)
+    return new_data
+
+
+def shuffle_iterable(ds: IterableDataset):
+    """shuffle IterableDataset through a buffer, seeded from the current stream of 'pklue.rng'."""
+    return ds.shuffle(seed=draw_seed(), buffer_size=STREAMING_BUFFER_SIZE)
+
+
+def sample_indices(num_rows, k, rng: np.random.Generator = None):
+    """k distinct random row indices out of num_rows, in ascending order.
+
+    Drawn without building a permutation of all rows, so the cost is O(k) regardless of num_rows.
+    rng defaults to the next generator of the current stream of 'pklue.rng'.
+    """
+    if rng is None:
+        rng = generator()
+    return np.sort(rng.choice(num_rows, size=k, replace=False))
+
+
+def subsample(ds: Union[Dataset, IterableDataset], max_examples=None, flatten_indices=False):
+    """random 'max_examples' rows of 'ds'.
+
+    Returns a 'select()' view which keeps the source order of the rows, so nothing is copied,
+    or a copy without the indices mapping if 'flatten_indices', which makes later 'map' calls cheaper.
+    IterableDataset takes 'max_examples' rows through a shuffle buffer.
+    """
+    if isinstance(ds, IterableDataset):
+        return shuffle_iterable(ds).take(max_examples) if max_examples else ds
+    if not max_examples or max_examples >= len(ds):
+        return ds
+    with stage('subsample') as s:
+        ds = ds.select(sample_indices(len(ds), max_examples))
+        if flatten_indices:
+            ds = ds.flatten_indices()
+        s.set_result(ds)
     return ds
+
+
+def load_dataset_max_examples(
+        dataset_name, split=None, max_examples=None, subset: str = None, streaming=False, flatten_indices=False
+):
+    """load dataset through the mirror resolver and truncate it to random 'max_examples' rows. see 'subsample'.
+
+    If streaming, returns IterableDataset and picks 'max_examples' rows through a shuffle buffer.
+    """
+    with stage('load') as s:
+        ds = resolve_dataset(dataset_name, subset, split=split, streaming=streaming)
+        s.set_result(ds)
+    return normalize_text(subsample(ds, max_examples, flatten_indices=flatten_indices))